@@ -1,13 +1,15 @@
 import json
-import re
 import datetime
 from itertools import groupby
 import logging
 
+import numpy as np
+
+from django.conf import settings
 from django.db import connection
 from django.db.models import Prefetch, Q, Count
 from django.shortcuts import get_object_or_404
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 
 from rest_framework import viewsets
 from rest_framework.pagination import PageNumberPagination
@@ -16,10 +18,17 @@ from rest_framework.permissions import AllowAny
 from rest_framework.views import Response
 from rest_framework.renderers import JSONRenderer
 
-from dplace_app.renderers import DPLACECSVRenderer
+from dplace_app.renderers import DPLACECSVRenderer, iter_csv
 from dplace_app import serializers
 from dplace_app import models
-from dplace_app.tree import update_newick
+from dplace_app.tree import trees_for_societies
+from dplace_app.search_index import get_index, parse_codes
+from dplace_app.postings import society_ids_for_codes
+from dplace_app.query import SocietyIdQuery
+from dplace_app.hydration import hydrate_societies, iter_hydrated_societies
+from dplace_app.cache import cached_result
+from dplace_app import name_index
+from dplace_app import binning
 
 
 log = logging.getLogger('profile')
@@ -193,20 +202,44 @@ def get_query_from_json(request):
     return query_dict
 
 
-def result_set_from_query_dict(query_dict):
+def matching_values(variable, codes):
+    """
+    :param codes: the list of code criteria for `variable` as returned by `parse_codes`.
+    :return: `Q` object selecting the values of `variable` matching the criteria.
+    """
+    if variable.data_type == 'Continuous':
+        q = Q(pk__in=[])
+        for c in codes:
+            if c['min'] is None:
+                q |= Q(coded_value='NA')
+            else:
+                q |= Q(coded_value_float__gte=c['min'], coded_value_float__lte=c['max'])
+        return q
+    return Q(code_id__in=[c['id'] for c in codes])
+
+
+def result_set_from_query_dict(query_dict, lazy=False):
+    """
+    :param lazy: If `True`, `societies` of the returned result set is a generator, \
+    hydrating the societies in chunks as it is consumed.
+    """
     from time import time
     _s = time()
     log.info('enter result_set_from_query_dict')
 
     result_set = serializers.SocietyResultSet()
-    sql_joins, sql_where = [], []
-
-    def id_array(l):
-        return '(%s)' % ','.join('%s' % int(i) for i in l)
+    query = SocietyIdQuery()
+    use_index = getattr(settings, 'DPLACE_SEARCH_INDEX', False)
+    candidates = None
+    # Unless a client explicitly asks for all values of the selected variables, we only
+    # return the values which matched the search criteria:
+    all_values = query_dict.get('all_values', False)
+    if isinstance(all_values, list):
+        all_values = any(all_values)
+    cvalue_filter = None if all_values else Q(pk__in=[])
 
     if 'l' in query_dict:
-        sql_joins.append(('language', 'l', 'l.id = s.language_id'))
-        sql_where.append('l.id IN ' + id_array(query_dict['l']))
+        query.filter('s.language_id = ANY(%s)', [int(i) for i in query_dict['l']])
         for lang in models.Language.objects.filter(id__in=query_dict['l']):
             result_set.languages.add(lang)
 
@@ -220,38 +253,43 @@ def result_set_from_query_dict(query_dict):
                 .filter(id__in=[int(x.split('-')[1]) for x in query_dict['c'] if len(x.split('-')) == 2])))
         }
 
-        for variable, codes in groupby(
-            sorted(query_dict['c'], key=lambda c: int(c.split('-')[0])),
-            key=lambda x: int(str(x).split('-')[0])
-        ):
+        codes_by_variable = parse_codes(query_dict['c'])
+        categorical = {
+            vid: [c['id'] for c in codes] for vid, codes in codes_by_variable.items()
+            if variables[vid].data_type != 'Continuous'}
+        if categorical and not use_index:
+            # Categorical filters are evaluated using the precomputed society bitmaps,
+            # if available:
+            candidates = society_ids_for_codes(categorical)
+
+        for variable, codes in sorted(codes_by_variable.items()):
             variable = variables[variable]
-            codes = [{
-                'id': None if (len(c.split('-')) > 2 or len(c.split('-')) == 1) else int(c.split('-')[1]),
-                'min': None if len(c.split('-')) < 3 else float(c.split('-')[1]),
-                'max': None if len(c.split('-')) < 3 else float(c.split('-')[2])
-            } for c in list(codes)]
-            
-            alias = 'cv%s' % variable.id
-            sql_joins.append((
-                "value",
-                alias,
-                "{0}.society_id = s.id AND {0}.variable_id = {1}".format(alias, variable.id)
-            ))
+            result_set.variable_descriptions.add(serializers.VariableCode(variable.codes, variable))
+            if cvalue_filter is not None:
+                cvalue_filter |= Q(variable_id=variable.id) & matching_values(variable, codes)
+            if candidates is not None and variable.data_type != 'Continuous':
+                continue
+
+            alias = query.join(
+                'value', 'cv', '{0}.society_id = s.id AND {0}.variable_id = %s', variable.id)
 
             if variable.data_type and variable.data_type == 'Continuous':
                 include_NA = not all((c['min'] is not None) for c in codes)
+                ranges = [c for c in codes if ('min' in c and c['min'] is not None)]
                 ors = [
-                    "({0}.coded_value_float >= %(min)f AND {0}.coded_value_float <= %(max)f)".format(alias) % c
-                    for c in codes if ('min' in c and c['min'] is not None)]
+                    "({0}.coded_value_float >= %s AND {0}.coded_value_float <= %s)".format(alias)
+                    for c in ranges]
                 if include_NA:
                     ors.append("%s.coded_value = 'NA'" % alias)
-                sql_where.append("(%s)" % ' OR '.join(ors))
+                query.filter(
+                    "(%s)" % ' OR '.join(ors),
+                    *[b for c in ranges for b in (c['min'], c['max'])])
                 if not include_NA:
-                    sql_where.append("{0}.coded_value != 'NA'".format(alias))
+                    query.filter("{0}.coded_value != 'NA'".format(alias))
             else:
                 assert all('id' in c for c in codes)
-                sql_where.append("{0}.code_id IN %s".format(alias) % id_array([x['id'] for x in codes]))
-            result_set.variable_descriptions.add(serializers.VariableCode(variable.codes, variable))
+                query.filter(
+                    "{0}.code_id = ANY(%s)".format(alias), [x['id'] for x in codes])
 
     if 'e' in query_dict:
         # There can be multiple filters, so we must aggregate the results.
@@ -259,73 +297,48 @@ def result_set_from_query_dict(query_dict):
             sorted(query_dict['e'], key=lambda c: c[0]),
             key=lambda x: x[0]
         ):
-            alias = 'ev%s' % varid
-            sql_joins.append((
-                "value",
-                alias,
-                "{0}.society_id = s.id AND {0}.variable_id = {1}".format(alias, int(varid))))
+            alias = query.join(
+                'value', 'ev', '{0}.society_id = s.id AND {0}.variable_id = %s', int(varid))
 
             for varid, operator, params in criteria:
                 params = map(float, params)
                 if operator == 'inrange':
-                    sql_where.append("{0}.coded_value_float >= {1:f} AND {0}.coded_value_float <= {2:f}".format(alias, params[0], params[1]))
+                    query.filter(
+                        "{0}.coded_value_float >= %s AND {0}.coded_value_float <= %s".format(alias),
+                        params[0], params[1])
                 elif operator == 'outrange':
-                    sql_where.append("{0}.coded_value_float >= {1:f} AND {0}.coded_value_float <= {2:f}".format(alias, params[1], params[0]))
+                    query.filter(
+                        "{0}.coded_value_float >= %s AND {0}.coded_value_float <= %s".format(alias),
+                        params[1], params[0])
                 elif operator == 'gt':
-                    sql_where.append("{0}.coded_value_float >= {1:f}".format(alias, params[0]))
+                    query.filter("{0}.coded_value_float >= %s".format(alias), params[0])
                 elif operator == 'lt':
-                    sql_where.append("{0}.coded_value_float <= {1:f}".format(alias, params[0]))
+                    query.filter("{0}.coded_value_float <= %s".format(alias), params[0])
 
         for variable in models.Variable.objects.filter(id__in=[x[0] for x in query_dict['e']]):
             result_set.environmental_variables.add(variable)
 
     if 'p' in query_dict:
-        sql_joins.append(('geographicregion', 'r', 'r.id = s.region_id'))
-        sql_where.append('r.id IN %s' % id_array(query_dict['p']))
+        query.filter('s.region_id = ANY(%s)', [int(i) for i in query_dict['p']])
         for region in models.GeographicRegion.objects.filter(id__in=query_dict['p']):
             result_set.geographic_regions.add(region)
 
-    if sql_where:
-        cursor = connection.cursor()
-        sql = "select distinct s.id from dplace_app_society as s %s where %s" % (
-            ' '.join('join dplace_app_%s as %s on %s' % t for t in sql_joins),
-            ' AND '.join(sql_where))
-        cursor.execute(sql)
-        soc_ids = [r[0] for r in cursor.fetchall()]
+    if use_index:
+        soc_ids = get_index().society_ids_for_query(query_dict)
+    elif candidates is not None and not (candidates and query.where):
+        soc_ids = sorted(candidates)
+    elif query.where:
+        if candidates is not None:
+            query.filter('s.id = ANY(%s)', sorted(candidates))
+        soc_ids = query.execute(connection)
     else:
         soc_ids = []
 
-    soc_query = models.Society.objects.filter(id__in=soc_ids)\
-        .select_related('source', 'language__family', 'region')
-    if result_set.geographic_regions:
-        soc_query = soc_query.select_related('region')
-    if result_set.variable_descriptions:
-        soc_query = soc_query.prefetch_related(Prefetch(
-            'value_set',
-            to_attr='selected_cvalues',
-            queryset=models.Value.objects
-            # FIXME: this selects possibly too many values, in case there are multiple
-            # values for the same variable, not all of them matching the criteria.
-            .filter(variable_id__in=[v.variable.id for v in result_set.variable_descriptions])
-            .select_related('code')
-            .prefetch_related('references')))
-    if result_set.environmental_variables:
-        soc_query = soc_query.prefetch_related(Prefetch(
-            'value_set',
-            to_attr='selected_evalues',
-            queryset=models.Value.objects
-            .filter(variable_id__in=[v.id for v in result_set.environmental_variables])
-            .prefetch_related('references')))
-
-    for i, soc in enumerate(soc_query):
-        soc_result = serializers.SocietyResult(soc)
-        if result_set.variable_descriptions:
-            for cval in soc.selected_cvalues:
-                soc_result.variable_coded_values.add(cval)
-        if result_set.environmental_variables:
-            for eval in soc.selected_evalues:
-                soc_result.environmental_values.add(eval)
-        result_set.societies.add(soc_result)
+    result_set.societies = (iter_hydrated_societies if lazy else hydrate_societies)(
+        soc_ids,
+        cvariable_ids=[v.variable.id for v in result_set.variable_descriptions],
+        evariable_ids=[v.id for v in result_set.environmental_variables],
+        cvalue_filter=cvalue_filter)
 
     log.info('mid 1: %s' % (time() - _s,))
 
@@ -338,23 +351,13 @@ def result_set_from_query_dict(query_dict):
 @api_view(['GET'])
 @permission_classes((AllowAny,))
 def trees_from_societies(request):
-    language_trees, labels, soc_ids = [], [], []
-
-    for k, v in request.query_params.lists():
-        soc_ids = v
-        labels = models.LanguageTreeLabels.objects.filter(societies__id__in=soc_ids).all()
-
-    for t in models.LanguageTree.objects\
-            .filter(taxa__societies__id__in=soc_ids)\
-            .prefetch_related(
-                'taxa__languagetreelabelssequence_set__labels',
-                'taxa__languagetreelabelssequence_set__society',
-            )\
-            .distinct():
-        if update_newick(t, labels):
-            language_trees.append(t)
-
-    return Response(serializers.LanguageTreeSerializer(language_trees, many=True).data)
+    try:
+        soc_ids = [int(v) for v in request.query_params.getlist('s')]
+    except ValueError:
+        raise Http404('malformed query parameter')
+    return Response([
+        serializers.pruned_tree_data(t) for t in
+        trees_for_societies(soc_ids, version=models.DataVersion.current())])
 
 
 @api_view(['GET'])
@@ -366,7 +369,7 @@ def find_societies(request):
     environmental_filters: [{id: 1, operator: 'gt', params: [0.0]},
     {id:3, operator 'inrange', params: [10.0,20.0] }] }
 
-    Returns serialized collection of SocietyResult objects
+    Returns a serialized SocietyResultSet
     """
     from time import time
     from django.db import connection
@@ -374,24 +377,23 @@ def find_societies(request):
     log.info('%s find_societies 1: %s queries' % (time() - s, len(connection.queries)))
     query = {}
     if 'name' in request.query_params:
-        result_set = serializers.SocietyResultSet()
-        q = request.query_params['name']
-        if q:
-            soc = models.Society.objects.filter(
-                Q(name__icontains=q) | Q(alternate_names__unaccent__icontains=q))
-            for s in soc:
-                if s.value_set.count():
-                    result_set.societies.add(serializers.SocietyResult(s))
-        return Response(serializers.SocietyResultSetSerializer(result_set).data)
+        return Response(cached_result(
+            'find_societies',
+            {'name': request.query_params['name']},
+            lambda: _societies_by_name(request.query_params['name'])))
 
     for k, v in request.query_params.lists():
         if str(k) == 'c':
             query[k] = v
         else:
             query[k] = [json.loads(vv) for vv in v]
-    result_set = result_set_from_query_dict(query)
-    log.info('%s find_societies 2: %s queries' % (time() - s, len(connection.queries)))
-    d = serializers.SocietyResultSetSerializer(result_set).data
+
+    def search():
+        result_set = result_set_from_query_dict(query)
+        log.info('%s find_societies 2: %s queries' % (time() - s, len(connection.queries)))
+        return serializers.SocietyResultSetSerializer(result_set).data
+
+    d = cached_result('find_societies', query, search)
     log.info('%s find_societies 3: %s queries' % (time() - s, len(connection.queries)))
     for i, q in enumerate(
             sorted(connection.queries, key=lambda q: q['time'], reverse=True)):
@@ -400,6 +402,15 @@ def find_societies(request):
     return Response(d)
 
 
+def _societies_by_name(q):
+    result_set = serializers.SocietyResultSet()
+    soc_ids = name_index.search(q)
+    rank = {sid: i for i, sid in enumerate(soc_ids)}
+    result_set.societies = sorted(
+        hydrate_societies(soc_ids), key=lambda r: rank[r['society']['id']])
+    return serializers.SocietyResultSetSerializer(result_set).data
+
+
 @api_view(['GET'])
 @permission_classes((AllowAny,))
 def get_categories(request):
@@ -443,11 +454,9 @@ def get_min_and_max(request):
     res = {}
     varid = get_query_from_json(request).get('environmental_id')
     if varid:
-        values = [
-            v.coded_value_float for v in models.Value.objects.filter(variable__id=varid)
-            if v.coded_value_float is not None]
-        vmin = min(values) if values else 0.0
-        vmax = max(values) if values else 0.0
+        stats = models.VariableStats.objects.filter(variable_id=varid).first()
+        vmin = stats.min if stats and stats.min is not None else 0.0
+        vmax = stats.max if stats and stats.max is not None else 0.0
         res = {'min': format(vmin, '.4f'), 'max': format(vmax, '.4f')}
     return Response(res)
 
@@ -456,47 +465,54 @@ def get_min_and_max(request):
 @permission_classes((AllowAny,))
 @renderer_classes((JSONRenderer,))
 def bin_cont_data(request):  # MAKE THIS GENERIC
-    bf_id = get_query_from_json(request).get('bf_id')
+    """
+    Bins for the values of a continuous variable. Besides the variable id `bf_id`, the
+    query may specify the binning `strategy` - one of 'equal' (default), 'quantile',
+    'jenks' or 'log' - and the number of `bins` (default 5).
+    """
+    query_dict = get_query_from_json(request)
+    bf_id = query_dict.get('bf_id')
+    strategy = query_dict.get('strategy', 'equal')
+    try:
+        nbins = int(query_dict.get('bins', 5))
+    except (TypeError, ValueError):
+        raise Http404('malformed query parameter')
+    if strategy not in binning.STRATEGIES or not 0 < nbins <= 100:
+        raise Http404('malformed query parameter')
+
     bins = []
     if bf_id:
-        values = models.Value.objects.filter(variable__id=bf_id)
-        min_value = None
-        max_value = 0.0
-        missing_data_option = False
-        for v in values:
-            if re.search('[a-zA-Z]', v.coded_value):
-                if not missing_data_option:
-                    bins.append({
-                        'code': v.coded_value,
-                        'description': v.code.description,
-                        'variable': bf_id,
-                    })
-                    missing_data_option = True
-                continue
-            else:
-                v.coded_value = v.coded_value.replace(',', '')
-                if min_value is None:
-                    min_value = float(v.coded_value)
-                elif float(v.coded_value) < min_value:
-                    min_value = float(v.coded_value)
-                elif float(v.coded_value) > max_value:
-                    max_value = float(v.coded_value)
-
-        min_value = min_value or 0.0  # This is the case when there are no values!
-        data_range = max_value - min_value
-        bin_size = data_range / 5
-        min_bin = min_value
-        for x in range(0, 5):
-            min = min_bin
-            max = min_bin + bin_size
+        stats = models.VariableStats.objects.filter(variable_id=bf_id).first() \
+            or models.VariableStats()
+        if stats.na_count:
+            bins.append({
+                'code': stats.na_value,
+                'description': stats.na_description,
+                'variable': bf_id,
+            })
+        if stats.min is None:  # This is the case when there are no values!
+            return Response(bins)
+
+        values, percentiles = None, None
+        if strategy == 'quantile':
+            percentiles = stats.get_quantiles() or None
+        if strategy in binning.NEEDS_VALUES and percentiles is None:
+            values = np.fromiter(
+                models.Value.objects
+                .filter(variable_id=bf_id, coded_value_float__isnull=False)
+                .values_list('coded_value_float', flat=True),
+                dtype=float)
+        edges = binning.bin_edges(
+            strategy, nbins, stats.min, stats.max, values=values, percentiles=percentiles)
+        for x, (vmin, vmax) in enumerate(zip(edges[:-1], edges[1:])):
+            vmin, vmax = float(vmin), float(vmax)
             bins.append({
                 'code': x,
-                'description': str(min) + ' - ' + str(max),
-                'min': min_bin,
-                'max': min_bin + bin_size,
+                'description': str(vmin) + ' - ' + str(vmax),
+                'min': vmin,
+                'max': vmax,
                 'variable': bf_id,
             })
-            min_bin = min_bin + bin_size + 1
     return Response(bins)
 
 
@@ -505,8 +521,20 @@ def bin_cont_data(request):  # MAKE THIS GENERIC
 @renderer_classes((DPLACECSVRenderer,))
 def csv_download(request):
     query_dict = get_query_from_json(request)
-    result_set = result_set_from_query_dict(query_dict)
-    response = Response(serializers.SocietyResultSetSerializer(result_set).data)
+    if getattr(settings, 'DPLACE_STREAMING_CSV', False):
+        # Rows are written as the societies are hydrated, so we do not hold the full
+        # result in memory - and do not cache it either.
+        result_set = result_set_from_query_dict(query_dict, lazy=True)
+        societies, result_set.societies = result_set.societies, []
+        response = StreamingHttpResponse(
+            iter_csv(serializers.SocietyResultSetSerializer(result_set).data, societies),
+            content_type=DPLACECSVRenderer.media_type)
+    else:
+        response = Response(cached_result(
+            'csv_download',
+            query_dict,
+            lambda: serializers.SocietyResultSetSerializer(
+                result_set_from_query_dict(query_dict)).data))
     filename = "dplace-societies-%s.csv" % datetime.datetime.now().strftime("%Y-%m-%d")
     response['Content-Disposition'] = 'attachment; filename="%s"' % filename
     return response
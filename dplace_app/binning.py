@@ -0,0 +1,114 @@
+# coding: utf8
+"""
+Binning of the values of continuous variables.
+
+All strategies return the `n + 1` edges of `n` contiguous bins between the minimum and
+the maximum value, computed with NumPy. Equal-width and log-scale bins only depend on
+minimum and maximum - which we have in `VariableStats` - and quantile bins are
+interpolated from the percentiles in `VariableStats`, while natural breaks are computed
+from the array of all values.
+"""
+from __future__ import unicode_literals
+
+import numpy as np
+
+# Strategies which need the values rather than only minimum and maximum:
+NEEDS_VALUES = ['quantile', 'jenks']
+# Natural breaks are computed on at most this many distinct points; larger value sets
+# are aggregated into a histogram first.
+MAX_JENKS_POINTS = 256
+
+
+def equal_width(n, vmin, vmax, values=None, percentiles=None):
+    return np.linspace(vmin, vmax, n + 1)
+
+
+def log_scale(n, vmin, vmax, values=None, percentiles=None):
+    """
+    Bins of equal width on a log scale. Non-positive values are shifted, so that the
+    minimum is mapped to 1.
+    """
+    shift = 0.0 if vmin > 0 else 1.0 - vmin
+    return np.exp(np.linspace(np.log(vmin + shift), np.log(vmax + shift), n + 1)) - shift
+
+
+def quantile(n, vmin, vmax, values=None, percentiles=None):
+    """
+    Bins with equal numbers of values. If the percentiles 0, 1, ..., 100 of the values
+    are passed, the edges are interpolated between them rather than computed from the
+    values.
+    """
+    q = np.linspace(0, 100, n + 1)
+    if percentiles is not None:
+        return np.interp(q, np.linspace(0, 100, len(percentiles)), percentiles)
+    return np.percentile(values, q)
+
+
+def _groups(values):
+    """
+    :return: triple of arrays (lower bound, representative value, weight) of sorted \
+    groups of values.
+    """
+    x, w = np.unique(values, return_counts=True)
+    if len(x) <= MAX_JENKS_POINTS:
+        return x, x, w
+    counts, edges = np.histogram(values, bins=MAX_JENKS_POINTS)
+    keep = counts > 0
+    return edges[:-1][keep], ((edges[:-1] + edges[1:]) / 2)[keep], counts[keep]
+
+
+def jenks(n, vmin, vmax, values=None, percentiles=None):
+    """
+    Natural breaks, i.e. the partition into `n` classes minimizing the sum of squared
+    deviations from the class means, computed with Fisher's dynamic programming
+    algorithm.
+    """
+    lower, x, w = _groups(values)
+    m = len(x)
+    n = min(n, m)
+    # Cumulative sums to compute the sums of squared deviations of groups i..j-1 for all
+    # pairs i < j at once:
+    s0, s1, s2 = [np.concatenate([[0], np.cumsum(a)]) for a in (w, w * x, w * x * x)]
+    i, j = np.arange(m + 1)[:, None], np.arange(m + 1)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ssd = s2[j] - s2[i] - (s1[j] - s1[i]) ** 2 / (s0[j] - s0[i])
+    ssd[np.broadcast_to(i >= j, ssd.shape)] = np.inf
+
+    cost = ssd[0].copy()
+    cost[0] = 0.0
+    starts = np.zeros((n, m + 1), dtype=int)
+    for k in range(1, n):
+        # Row i holds the cost of the partitions whose last class starts at group i:
+        total = cost[:, None] + ssd
+        total[:k] = np.inf
+        starts[k] = np.argmin(total, axis=0)
+        cost = total[starts[k], np.arange(m + 1)]
+
+    breaks, j = [], m
+    for k in range(n - 1, 0, -1):
+        j = starts[k, j]
+        breaks.append(lower[j])
+    return np.array([vmin] + breaks[::-1] + [vmax], dtype=float)
+
+
+STRATEGIES = {
+    'equal': equal_width,
+    'quantile': quantile,
+    'jenks': jenks,
+    'log': log_scale,
+}
+
+
+def bin_edges(strategy, n, vmin, vmax, values=None, percentiles=None):
+    """
+    :param strategy: one of `STRATEGIES`.
+    :param values: array of all values, required for the strategies in `NEEDS_VALUES` - \
+    except for 'quantile' if `percentiles` are passed.
+    :param percentiles: `list` of the percentiles 0, 1, ..., 100 of the values.
+    :return: array of bin edges; fewer than `n + 1` if some bins would be empty.
+    """
+    if vmin == vmax:
+        return np.array([vmin, vmax], dtype=float)
+    edges = STRATEGIES[strategy](n, vmin, vmax, values=values, percentiles=percentiles)
+    edges[0], edges[-1] = vmin, vmax
+    return np.unique(edges)
@@ -0,0 +1,213 @@
+# coding: utf8
+"""
+Caching of search results.
+
+Responses of `find_societies` and `csv_download` are cached in the Django cache named
+by the `DPLACE_RESULT_CACHE` setting, keyed on the canonicalized query and the
+current `DataVersion`, so that reloading the data invalidates all cached results.
+
+`LRUMemoryCache` is a process-local cache backend with least-recently-used eviction
+and a limit on the total size of the cached - pickled - values.
+"""
+from __future__ import unicode_literals
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.utils.six.moves import cPickle as pickle
+
+from dplace_app.models import DataVersion
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping which evicts the least recently used items once the total size
+    of the items exceeds `max_bytes`.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            value, size = self._items.pop(key)
+            self._items[key] = (value, size)
+            return value
+
+    def set(self, key, value, size):
+        """
+        :param size: size of `value` in bytes. Values bigger than the whole cache are \
+        not stored.
+        """
+        with self._lock:
+            self.delete(key)
+            if size > self.max_bytes:
+                return False
+            self._items[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, s) = self._items.popitem(last=False)
+                self.nbytes -= s
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._items:
+                _, size = self._items.pop(key)
+                self.nbytes -= size
+                return True
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+# Like Django's locmem backend, we share the store between all backend instances for
+# the same location:
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+class LRUMemoryCache(BaseCache):
+    """
+    Django cache backend storing pickled values in an `LRUCache`.
+
+    The size limit is configured as `OPTIONS = {'MAX_BYTES': ...}`.
+    """
+    def __init__(self, location, params):
+        BaseCache.__init__(self, params)
+        max_bytes = int(params.get('OPTIONS', {}).get('MAX_BYTES', 64 * 1024 * 1024))
+        with _STORES_LOCK:
+            self._store = _STORES.setdefault(location, LRUCache(max_bytes))
+
+    def _get(self, key):
+        item = self._store.get(key)
+        if item is None:
+            return None
+        expires, pickled = item
+        if expires is not None and expires <= time.time():
+            self._store.delete(key)
+            return None
+        return pickled
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        if self._get(key) is not None:
+            return False
+        return self._set(key, value, timeout)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        pickled = self._get(key)
+        return default if pickled is None else pickle.loads(pickled)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._set(key, value, timeout)
+
+    def _set(self, key, value, timeout):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return self._store.set(
+            key, (self.get_backend_timeout(timeout), pickled), len(pickled))
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._store.delete(key)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._get(key) is not None
+
+    def clear(self):
+        self._store.clear()
+
+
+def _ids(ids):
+    return sorted(set(int(i) for i in ids))
+
+
+def _float(f):
+    return repr(float(f))
+
+
+def canonical_code(code):
+    """
+    Normalize a serialized code "<variable id>-<code id>" or "<variable id>-<min>-<max>".
+    """
+    parts = code.split('-')
+    if len(parts) == 3:
+        return '%s-%s-%s' % (int(parts[0]), _float(parts[1]), _float(parts[2]))
+    return '-'.join('%s' % int(p) for p in parts)
+
+
+def canonical_query(query_dict):
+    """
+    Returns a normalized copy of a search query, such that equivalent queries - with
+    criteria in different order, duplicate ids or differently formatted numbers -
+    map to the same `dict`.
+    """
+    res = {}
+    for key, value in query_dict.items():
+        if key == 'c':
+            value = sorted(set(canonical_code(c) for c in value))
+        elif key in ['l', 'p']:
+            value = _ids(value)
+        elif key == 'e':
+            value = sorted(set(
+                (int(varid), operator, tuple(_float(p) for p in params))
+                for varid, operator, params in value))
+        elif key == 'all_values':
+            value = any(value) if isinstance(value, list) else bool(value)
+        res[key] = value
+    return res
+
+
+def cache_key(name, query_dict):
+    query = json.dumps(canonical_query(query_dict), sort_keys=True)
+    return 'dplace:%s:%s:%s' % (
+        name, DataVersion.current(), hashlib.md5(query.encode('utf8')).hexdigest())
+
+
+def get_result_cache():
+    alias = getattr(settings, 'DPLACE_RESULT_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def cached_result(name, query_dict, func):
+    """
+    Return the result of `func()` for a query, looked up in the result cache if one is
+    configured.
+
+    :param name: name of the view, to keep results of different views apart.
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return func()
+    key = cache_key(name, query_dict)
+    res = cache.get(key)
+    if res is None:
+        res = func()
+        cache.set(key, res)
+    return res
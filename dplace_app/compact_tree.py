@@ -0,0 +1,310 @@
+# coding: utf8
+"""
+Array-backed representation of a phylogeny, supporting fast pruning.
+
+Nodes are numbered in preorder, so the root has index 0 and every node has a larger
+index than its parent. The topology is stored in parent, first-child and next-sibling
+arrays; branch lengths and node names in parallel arrays. An Euler tour of the tree with
+a sparse table of depth minima provides lowest common ancestor queries in O(1).
+
+`CompactTree.prune` computes the Newick representation of the tree pruned to a set of
+node names without creating node objects. The result is the same as pruning an ete3
+tree with `dplace_app.tree.prune` and writing it with `Tree.write(format=1)`.
+"""
+from __future__ import unicode_literals
+from array import array
+from collections import Counter, OrderedDict
+import re
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+
+import numpy as np
+from ete3 import Tree
+from ete3.parser.newick import FLOAT_FORMATTER, NAME_FORMATTER, _ILEGAL_NEWICK_CHARS
+
+ILLEGAL_CHARS = re.compile('[' + _ILEGAL_NEWICK_CHARS + ']')
+
+
+class CompactTree(object):
+    def __init__(self, tree):
+        """
+        :param tree: ete3 `Tree` instance.
+        """
+        nodes = list(tree.traverse('preorder'))
+        index = {id(n): i for i, n in enumerate(nodes)}
+        self.size = len(nodes)
+        self.parent = array(str('i'), [-1] * self.size)
+        self.first_child = array(str('i'), [-1] * self.size)
+        self.next_sibling = array(str('i'), [-1] * self.size)
+        self.depth = array(str('i'), [0] * self.size)
+        self.dist = array(str('d'), [n.dist for n in nodes])
+        self.names = [n.name for n in nodes]
+        self.name_index = {}
+
+        for i, n in enumerate(nodes):
+            self.name_index.setdefault(n.name, []).append(i)
+            children = [index[id(c)] for c in n.children]
+            if children:
+                self.first_child[i] = children[0]
+            for c, s in zip(children, children[1:] + [-1]):
+                self.parent[c] = i
+                self.next_sibling[c] = s
+                self.depth[c] = self.depth[i] + 1
+
+        # The subtree rooted at node i spans the indices i..end[i]:
+        self.end = array(str('i'), range(self.size))
+        for i in reversed(range(1, self.size)):
+            self.end[self.parent[i]] = max(self.end[self.parent[i]], self.end[i])
+        # Position of each node in postorder:
+        self.postorder_index = array(str('i'), [0] * self.size)
+        for pos, i in enumerate(self._postorder()):
+            self.postorder_index[i] = pos
+        self._build_lca_index()
+
+    @classmethod
+    def from_newick(cls, newick):
+        return cls(Tree(newick, format=1))
+
+    def __getstate__(self):
+        # The name index and the upper levels of the sparse table are cheap to re-compute:
+        state = dict(self.__dict__)
+        del state['name_index']
+        state['sparse_table'] = self.sparse_table[:1]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.name_index = {}
+        for i, name in enumerate(self.names):
+            self.name_index.setdefault(name, []).append(i)
+        self._build_sparse_table(self.sparse_table[0])
+
+    def dumps(self):
+        """
+        :return: compressed binary serialization of the tree.
+        """
+        return zlib.compress(pickle.dumps(self, pickle.HIGHEST_PROTOCOL))
+
+    @classmethod
+    def loads(cls, data):
+        return pickle.loads(zlib.decompress(bytes(data)))
+
+    def children(self, i):
+        c = self.first_child[i]
+        while c != -1:
+            yield c
+            c = self.next_sibling[c]
+
+    def _postorder(self):
+        res, stack = [], [(0, False)]
+        while stack:
+            i, visited = stack.pop()
+            if visited or self.first_child[i] == -1:
+                res.append(i)
+            else:
+                stack.append((i, True))
+                stack.extend((c, False) for c in reversed(list(self.children(i))))
+        return res
+
+    def _euler_tour(self):
+        """
+        :return: `list` of the nodes visited in a depth-first traversal, listing a node \
+        again after each of its children.
+        """
+        res, stack = [], [(0, self.children(0))]
+        res.append(0)
+        while stack:
+            i, children = stack[-1]
+            c = next(children, None)
+            if c is None:
+                stack.pop()
+                if stack:
+                    res.append(stack[-1][0])
+            else:
+                res.append(c)
+                stack.append((c, self.children(c)))
+        return res
+
+    def _build_lca_index(self):
+        """
+        The lowest common ancestor of two nodes is the node of minimal depth between
+        their first occurrences in the Euler tour. We precompute a sparse table of these
+        minima for all ranges of length 2**k, so that an LCA query takes O(1).
+
+        Table entries are encoded as `depth * size + node`, so that the minimal entry
+        identifies the node of minimal depth.
+        """
+        euler = np.array(self._euler_tour(), dtype=np.int64)
+        self.first = array(str('i'), [0] * self.size)
+        for pos in reversed(range(len(euler))):
+            self.first[euler[pos]] = pos
+        keys = np.array(self.depth, dtype=np.int64)[euler] * self.size + euler
+        self._build_sparse_table(
+            keys.astype(np.int32 if keys.max() < 2 ** 31 else np.int64))
+
+    def _build_sparse_table(self, keys):
+        self.sparse_table = [keys]
+        h = 1
+        while 2 * h <= len(keys):
+            prev = self.sparse_table[-1]
+            self.sparse_table.append(np.minimum(prev[:-h], prev[h:]))
+            h *= 2
+
+    def lca(self, i, j):
+        """
+        :return: index of the lowest common ancestor of nodes `i` and `j`.
+        """
+        l, r = sorted([self.first[i], self.first[j]])
+        k = (r - l + 1).bit_length() - 1
+        table = self.sparse_table[k]
+        return int(min(table[l], table[r - 2 ** k + 1]) % self.size)
+
+    def leaves(self, i):
+        """
+        :return: `list` of the leaves in the subtree rooted at node `i`.
+        """
+        return [j for j in range(i, self.end[i] + 1) if self.first_child[j] == -1]
+
+    def induced_subtree(self, nodes):
+        """
+        The subtree induced by a set of nodes consists of the nodes and the lowest common
+        ancestors of all pairs of them. It suffices to add the LCAs of nodes adjacent in
+        preorder, thus the induced subtree of k nodes is computed in O(k log k).
+
+        :param nodes: set of node indices.
+        :return: `OrderedDict` mapping the nodes of the induced subtree in preorder to \
+        their parent in the induced subtree (or `None` for its root).
+        """
+        ordered = sorted(nodes)
+        ordered = sorted(
+            set(ordered).union(self.lca(i, j) for i, j in zip(ordered, ordered[1:])))
+        res, stack = OrderedDict(), []
+        for i in ordered:
+            while stack and self.end[stack[-1]] < i:
+                stack.pop()
+            res[i] = stack[-1] if stack else None
+            stack.append(i)
+        return res
+
+    def nodes_to_keep(self, seeds, const_depth=True, keep_root=False):
+        """
+        Besides the seeds, pruning keeps one node for each set of seeds whose paths
+        to the root meet, i.e. at the branching points of the subtree induced by the
+        seeds.
+
+        :param seeds: set of node indices.
+        :return: set of the node indices to keep.
+        """
+        keep = set(seeds)
+        if keep_root:
+            keep.add(0)
+        if len(seeds) < 2:
+            return keep
+
+        induced = self.induced_subtree(seeds)
+        # Number of seeds in the subtree of a node and number of children, both in the
+        # induced subtree:
+        count, nchildren = Counter(), Counter()
+        for i, p in reversed(induced.items()):
+            count[i] += 1 if i in seeds else 0
+            if p is not None:
+                count[p] += count[i]
+                nchildren[p] += 1
+
+        # The nodes on the path from a node of the induced subtree up to its parent in the
+        # induced subtree (exclusively) have the same set of seeds below. These chains of
+        # nodes are the candidates for keeping one node each.
+        start = next(iter(induced))
+        for i, p in induced.items():
+            if count[i] < 2:
+                continue
+            lowest = self.parent[i] if i in seeds else i
+            if lowest == -1 or lowest == p:
+                # i is a seed and the chain is empty.
+                continue
+            if p is None:
+                if keep_root:
+                    continue
+                # Like `dplace_app.tree.prune`, we keep the node farthest from the common
+                # ancestor of all seeds in terms of ete3's topological distance - or
+                # with `const_depth`, where all nodes are at the same distance - the
+                # lowest node. For the chain from the common ancestor up to the root
+                # this is the root, unless the common ancestor is a child of the root.
+                # For all other chains it is the common ancestor of the seeds below it.
+                keep.add(0 if not const_depth and self.depth[start] > 1 else lowest)
+            elif not (p in seeds and nchildren[p] == 1):
+                # Otherwise the chain extends up to the seed p.
+                keep.add(lowest)
+        return keep
+
+    def prune(self, names, const_depth=True, keep_root=False):
+        """
+        :param names: names of the nodes to keep.
+        :param const_depth: see `dplace_app.tree.prune`.
+        :return: Newick representation of the pruned tree or `None` if none of the \
+        names is found in the tree.
+        """
+        seeds = set(i for name in names for i in self.name_index.get(name, []))
+        if not seeds:
+            return None
+        keep = self.nodes_to_keep(seeds, const_depth=const_depth, keep_root=keep_root)
+
+        # Only the nodes on the paths from the nodes to keep to the root are relevant for
+        # the result:
+        relevant = {0}
+        for i in keep:
+            while i not in relevant:
+                relevant.add(i)
+                i = self.parent[i]
+        relevant_children = {}
+        for i in sorted(relevant):
+            if i:
+                relevant_children.setdefault(self.parent[i], []).append(i)
+
+        # Emulate removing the nodes not to keep in postorder: A removed node is replaced
+        # by its current children, which are appended to the children of its parent;
+        # its branch length is added to its only child, or to its parent.
+        dist = {i: self.dist[i] for i in relevant}
+        children = {}
+        for i in sorted(relevant, key=lambda i: self.postorder_index[i]):
+            current = [c for c in relevant_children.get(i, []) if c in keep]
+            for c in relevant_children.get(i, []):
+                if c not in keep:
+                    current.extend(children.pop(c, []))
+            if i not in keep and i != 0:
+                if len(current) == 1:
+                    dist[current[0]] += dist[i]
+                elif len(current) > 1:
+                    dist[self.parent[i]] += dist[i]
+            if current:
+                children[i] = current
+        return self._newick(children, dist)
+
+    def _format(self, i, dist):
+        return '%s:%s' % (
+            NAME_FORMATTER % ILLEGAL_CHARS.sub('_', str(self.names[i])),
+            FLOAT_FORMATTER % dist[i])
+
+    def _newick(self, children, dist):
+        if not children.get(0):
+            return self._format(0, dist) + ';'
+        res, stack = [], [(0, False)]
+        while stack:
+            i, closing = stack.pop()
+            if closing:
+                res.append(')')
+                if i != 0:
+                    res.append(self._format(i, dist))
+                continue
+            if res and res[-1] != '(':
+                res.append(',')
+            if children.get(i):
+                res.append('(')
+                stack.append((i, True))
+                stack.extend((c, False) for c in reversed(children[i]))
+            else:
+                res.append(self._format(i, dist))
+        return ''.join(res) + ';'
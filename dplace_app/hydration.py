@@ -0,0 +1,143 @@
+# coding: utf8
+"""
+Hydration of search results.
+
+Societies, their selected values, codes and references are fetched as tuples in a
+fixed number of queries, and turned directly into the data structures which
+`SocietyWithRegionSerializer` and `ValueSerializer` would produce - without
+instantiating model objects or running DRF's field machinery per object.
+"""
+from __future__ import unicode_literals
+from collections import defaultdict
+
+from django.db.models import Q
+
+from dplace_app.models import Society, Value
+
+SOURCE_FIELDS = ('id', 'year', 'author', 'reference', 'name')
+REGION_FIELDS = ('id', 'level_2_re', 'count', 'region_nam', 'continent', 'tdwg_code')
+CODE_FIELDS = ('id', 'code', 'description', 'short_description', 'variable')
+SOCIETY_FIELDS = (
+    'id', 'ext_id', 'xd_id', 'name', 'original_name', 'alternate_names', 'focal_year',
+    'latitude', 'longitude', 'original_latitude', 'original_longitude',
+    'language_id', 'language__name', 'language__glotto_code', 'language__iso_code',
+    'language__family_id', 'language__family__name') + \
+    tuple('source__' + f for f in SOURCE_FIELDS) + \
+    tuple('region__' + f for f in REGION_FIELDS)
+VALUE_FIELDS = (
+    'id', 'variable_id', 'society_id', 'coded_value', 'coded_value_float', 'source_id',
+    'subcase', 'focal_year', 'comment') + tuple('code__' + f for f in CODE_FIELDS)
+
+
+def _float(v):
+    return None if v is None else float(v)
+
+
+def _nested(row, fields, start, converters=None):
+    """
+    Returns the slice of `row` for the fields of a related object as `dict`, or `None`
+    if there is no related object.
+    """
+    values = row[start:start + len(fields)]
+    if values[0] is None:
+        return None
+    converters = converters or {}
+    return {f: converters.get(f, lambda v: v)(v) for f, v in zip(fields, values)}
+
+
+def _society(row):
+    r = dict(zip(SOCIETY_FIELDS[:11], row[:11]))
+    language = None
+    if row[11] is not None:
+        language = {
+            'id': row[11],
+            'name': row[12],
+            'glotto_code': row[13],
+            'iso_code': row[14],
+            'family': None if row[15] is None else {'id': row[15], 'name': row[16]},
+        }
+    return {
+        'id': r['id'],
+        'ext_id': r['ext_id'],
+        'xd_id': r['xd_id'],
+        'name': r['name'],
+        'original_name': r['original_name'],
+        'alternate_names': r['alternate_names'],
+        'location': dict(coordinates=[r['longitude'], r['latitude']]),
+        'original_location': dict(
+            coordinates=[r['original_longitude'], r['original_latitude']]),
+        'language': language,
+        'focal_year': r['focal_year'],
+        'source': _nested(row, SOURCE_FIELDS, 17),
+        'region': _nested(
+            row, REGION_FIELDS, 17 + len(SOURCE_FIELDS),
+            dict(level_2_re=_float, count=_float)),
+    }
+
+
+def _value(row, references):
+    return {
+        'id': row[0],
+        'variable': row[1],
+        'society': row[2],
+        'coded_value': row[3],
+        'coded_value_float': _float(row[4]),
+        'code_description': _nested(row, CODE_FIELDS, 9),
+        'source': row[5],
+        'references': references.get(row[0], []),
+        'subcase': row[6],
+        'focal_year': row[7],
+        'comment': row[8],
+    }
+
+
+def hydrate_societies(soc_ids, cvariable_ids=None, evariable_ids=None, cvalue_filter=None):
+    """
+    :param soc_ids: ids of the societies in the search result.
+    :param cvariable_ids: ids of the variables to include in `variable_coded_values`.
+    :param evariable_ids: ids of the variables to include in `environmental_values`.
+    :param cvalue_filter: optional `Q` object restricting the values included in \
+    `variable_coded_values`, e.g. to the ones matching the search criteria.
+    :return: `list` of `dict`s in the format of the `societies` in a serialized \
+    `SocietyResultSet`, ordered by society id.
+    """
+    cvariable_ids, evariable_ids = set(cvariable_ids or []), set(evariable_ids or [])
+    res, values = [], defaultdict(list)
+
+    if cvariable_ids or evariable_ids:
+        cvalues = Q(variable_id__in=cvariable_ids)
+        if cvalue_filter is not None:
+            cvalues &= cvalue_filter
+        value_query = Value.objects.filter(
+            Q(society_id__in=soc_ids) & (cvalues | Q(variable_id__in=evariable_ids)))
+        references = defaultdict(list)
+        for row in Value.references.through.objects\
+                .filter(value__in=value_query.values('id'))\
+                .order_by('value_id', 'source_id')\
+                .values_list('value_id', *['source__' + f for f in SOURCE_FIELDS]):
+            references[row[0]].append(dict(zip(SOURCE_FIELDS, row[1:])))
+
+        for row in value_query.values_list(*VALUE_FIELDS):
+            values[row[2]].append(_value(row, references))
+
+    for row in Society.objects.filter(id__in=soc_ids).order_by('id')\
+            .values_list(*SOCIETY_FIELDS):
+        vals = values.get(row[0], [])
+        res.append({
+            'society': _society(row),
+            'variable_coded_values': [v for v in vals if v['variable'] in cvariable_ids],
+            'environmental_values': [v for v in vals if v['variable'] in evariable_ids],
+        })
+    return res
+
+
+def iter_hydrated_societies(soc_ids, chunk_size=500, **kw):
+    """
+    Generator yielding the same items as `hydrate_societies`, hydrating `chunk_size`
+    societies at a time, thus keeping memory usage independent of the number of
+    societies.
+    """
+    soc_ids = sorted(soc_ids)
+    for i in range(0, len(soc_ids), chunk_size):
+        for item in hydrate_societies(soc_ids[i:i + chunk_size], **kw):
+            yield item
@@ -10,19 +10,26 @@ import django
 django.setup()
 
 from django.db import transaction
+from django.db.models import Q
 from clldutils.dsv import reader
 from clldutils.text import split_text
 from clldutils.path import Path
 from clldutils import jsonlib
 import attr
 
-from dplace_app.models import Source
+from dplace_app import models
+from dplace_app.models import Source, DataVersion
+from dplace_app.name_index import build_name_index, update_has_values
+from dplace_app.postings import build_bitmaps
+from dplace_app.stats import build_variable_stats
+from dplace_app.tree import build_tree_index
 from loader.util import configure_logging, load_regions
 from loader.society import society_locations, load_societies, load_society_relations
 from loader.tree import load_trees
 from loader.variables import load_vars
 from loader.values import load_data
-from loader.sources import load_references
+from loader.sources import load_references, update_references, get_source
+from loader.manifest import changed_files, save_manifest
 from loader.glottocode import load_languages
 
 comma_split = partial(split_text, separators=',', strip=True, brackets={})
@@ -107,12 +114,17 @@ class Dataset(ObjectWithSource):
     description = attr.ib()
 
     def _items(self, what, **kw):
+        """
+        Rows are read lazily, so that large files need not be held in memory.
+        """
         fname = self.dir.joinpath('{0}.csv'.format(what))
-        return list(reader(fname, **kw)) if fname.exists() else []
+        if fname.exists():
+            for item in reader(fname, **kw):
+                yield item
 
     @property
     def data(self):
-        return [Data(**d) for d in self._items('data', dicts=True)]
+        return (Data(**d) for d in self._items('data', dicts=True))
 
     @property
     def references(self):
@@ -124,17 +136,17 @@ class Dataset(ObjectWithSource):
 
     @property
     def society_relations(self):
-        return [
-            RelatedSocieties(**d) for d in self._items('societies_mapping', dicts=True)]
+        return (
+            RelatedSocieties(**d) for d in self._items('societies_mapping', dicts=True))
 
     @property
     def variables(self):
         codes = {vid: list(c) for vid, c in groupby(
             sorted(self._items('codes', namedtuples=True), key=lambda c: c.var_id),
             lambda c: c.var_id)}
-        return [
+        return (
             Variable(codes=codes.get(v['id'], []), **v)
-            for v in self._items('variables', dicts=True)]
+            for v in self._items('variables', dicts=True))
 
 
 @attr.s
@@ -180,30 +192,116 @@ class Repos(object):
         return jsonlib.load(self.path(*comps))
 
 
-def load(repos, test=True):
+def reload_datasets(repos, changes, test=True):
+    """
+    Reload the variables and values of changed datasets.
+
+    Societies are referenced by languages, trees and society relations, so changes to
+    the societies - including added or removed datasets - require a full reload. So do
+    removed references, which may be linked to values of all datasets.
+
+    :param changes: `dict` mapping dataset ids to the names of the changed files, see \
+    `loader.manifest.changed_files`.
+    :return: pair of `set`s of the ids of the variables and of the societies whose values \
+    may have changed.
+    """
+    datasets = {ds.id: ds for ds in repos.datasets}
+    full = sorted(
+        dsid for dsid, files in changes.items() if dsid not in datasets or 'societies' in files)
+    if full:
+        raise ValueError('changes to datasets %s require a full reload' % ', '.join(full))
+    if any('references' in files for files in changes.values()):
+        # References are shared by all datasets:
+        update_references(repos)
+
+    def variable_ids(source):
+        # The variables of the dataset and those of other datasets with values in it:
+        return set(models.Variable.objects.filter(source=source).values_list('id', flat=True))\
+            | set(models.Value.objects.filter(source=source)
+                  .values_list('variable_id', flat=True).distinct())
+
+    def society_ids(source):
+        return set(models.Value.objects.filter(source=source)
+                   .values_list('society_id', flat=True).distinct())
+
+    variables, societies = set(), set()
+    for dsid, files in sorted(changes.items()):
+        ds, start = datasets[dsid], time()
+        source = get_source(ds)
+        variables |= variable_ids(source)
+        societies |= society_ids(source)
+        if files & {'variables', 'codes'}:
+            if models.Value.objects\
+                    .filter(variable__source=source).exclude(source=source).exists():
+                raise ValueError(
+                    'variables of dataset %s have values in other datasets; '
+                    'changes require a full reload' % dsid)
+            models.Value.objects.filter(Q(source=source) | Q(variable__source=source)).delete()
+            models.Variable.objects.filter(source=source).delete()
+        else:
+            models.Value.objects.filter(source=source).delete()
+
+        if files & {'variables', 'codes'}:
+            load_vars(repos, datasets=[ds])
+        load_data(repos, datasets=[ds])
+        variables |= variable_ids(source)
+        societies |= society_ids(source)
+        if not test:
+            print("%s reloaded in %s secs" % (dsid, time() - start))  # pragma: no cover
+    return variables, societies
+
+
+def load(repos, test=True, incremental=False):
+    """
+    :param incremental: only reload the datasets which changed since the last load.
+    """
     configure_logging(test=test)
     repos = Repos(repos)
 
-    for func in [
-        load_societies,
-        load_society_relations,
-        load_regions,
-        society_locations,
-        load_vars,
-        load_languages,
-        load_references,
-        load_data,
-        load_trees,
-    ]:
+    if incremental:
+        changes = changed_files(repos)
+        if not changes:
+            return
         with transaction.atomic():
-            if not test:
-                print("%s..." % func.__name__)  # pragma: no cover
-            start = time()
-            res = func(repos)
-            if not test:
-                print("%s loaded in %s secs" % (res, time() - start))  # pragma: no cover
+            variables, societies = reload_datasets(repos, changes, test=test)
+    else:
+        for func in [
+            load_societies,
+            load_society_relations,
+            load_regions,
+            society_locations,
+            load_vars,
+            load_languages,
+            load_references,
+            load_data,
+            load_trees,
+        ]:
+            with transaction.atomic():
+                if not test:
+                    print("%s..." % func.__name__)  # pragma: no cover
+                start = time()
+                res = func(repos)
+                if not test:
+                    print("%s loaded in %s secs" % (res, time() - start))  # pragma: no cover
+
+    with transaction.atomic():
+        if incremental:
+            # Societies and trees are never reloaded incrementally, so only the derived
+            # data of the variables and societies of the reloaded values must be updated:
+            update_has_values(societies)
+            build_variable_stats(variables)
+            if models.SocietyBitmap.objects.exists():
+                build_bitmaps(variables)
+        else:
+            build_name_index()
+            build_variable_stats()
+            build_tree_index()
+            if models.SocietyBitmap.objects.exists():
+                build_bitmaps()
+        save_manifest(repos)
+        DataVersion.objects.create()
 
 
 if __name__ == '__main__':  # pragma: no cover
-    load(Path(sys.argv[1]), test=False)
+    load(Path(sys.argv[1]), test=False, incremental='--incremental' in sys.argv[2:])
     sys.exit(0)
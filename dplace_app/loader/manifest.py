@@ -0,0 +1,60 @@
+# coding: utf8
+"""
+Detection of changed datasets for incremental reloads.
+
+The loader records the SHA1 hashes of the files of each dataset in `LoadManifest`. An
+incremental reload compares these with the hashes of the files in the repository and
+only reloads the datasets whose files changed.
+"""
+from __future__ import unicode_literals
+import hashlib
+
+from dplace_app.models import LoadManifest
+
+FILES = ['societies', 'variables', 'codes', 'data', 'references']
+
+
+def file_hash(path):
+    if not path.exists():
+        return ''
+    sha1 = hashlib.sha1()
+    with open(path.as_posix(), 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def dataset_hashes(ds):
+    """
+    :return: `dict` mapping the names of the dataset files to their hashes.
+    """
+    return {name: file_hash(ds.dir.joinpath('%s.csv' % name)) for name in FILES}
+
+
+def changed_files(repos):
+    """
+    :return: `dict` mapping the ids of all datasets in the repository and in the manifest \
+    to the `set` of the names of the files which changed since the last load.
+    """
+    manifest = {}
+    for m in LoadManifest.objects.all():
+        manifest.setdefault(m.dataset, {})[m.filename] = m.sha1
+
+    res = {}
+    for ds in repos.datasets:
+        old = manifest.pop(ds.id, {})
+        changed = set(
+            name for name, sha1 in dataset_hashes(ds).items() if old.get(name) != sha1)
+        if changed:
+            res[ds.id] = changed
+    # Datasets which have been removed:
+    for dsid in manifest:
+        res[dsid] = set(FILES)
+    return res
+
+
+def save_manifest(repos):
+    LoadManifest.objects.all().delete()
+    LoadManifest.objects.bulk_create([
+        LoadManifest(dataset=ds.id, filename=name, sha1=sha1)
+        for ds in repos.datasets for name, sha1 in sorted(dataset_hashes(ds).items())])
@@ -1,10 +1,12 @@
 # coding: utf8
 from __future__ import unicode_literals
 import logging
+from collections import namedtuple
 
 from dplace_app.models import Society, GeographicRegion, SocietyRelation
 
 from sources import get_source
+from util import map_datasets
 
 
 def society_locations(repos):
@@ -45,36 +47,54 @@ def load_society_relations(repos):
     return count
 
 
-def load_societies(repos):
+# Compact representation of a row of societies.csv, as shipped back by parsing workers.
+SocietyRow = namedtuple('SocietyRow', [
+    'ext_id',
+    'xd_id',
+    'original_name',
+    'name',
+    'alternate_names',
+    'focal_year',
+    'hraf_link',
+    'latitude',
+    'longitude',
+    'original_latitude',
+    'original_longitude',
+])
+
+
+def parse_societies(ds):
+    for item in ds.societies:
+        lat, lon, olat, olon = None, None, None, None
+        try:
+            lat, lon = map(float, [item.Lat, item.Long])
+        except (TypeError, ValueError):
+            logging.warn("Unable to create coordinates for %s" % item)
+        try:
+            olat, olon = map(float, [item.origLat, item.origLong])
+        except (TypeError, ValueError):
+            logging.warn("Unable to create original coordinates for %s" % item)
+
+        yield SocietyRow(
+            item.id,
+            item.xd_id,
+            item.ORIG_name_and_ID_in_this_dataset,
+            item.pref_name_for_society,
+            item.alt_names_by_society,
+            item.main_focal_year,
+            item.HRAF_name_ID,
+            lat,
+            lon,
+            olat,
+            olon)
+
+
+def load_societies(repos, workers=None):
     societies = []
-    for ds in repos.datasets:
-        for item in ds.societies:
-            lat, lon, olat, olon = None, None, None, None
-            try:
-                lat, lon = map(float, [item.Lat, item.Long])
-            except (TypeError, ValueError):
-                logging.warn("Unable to create coordinates for %s" % item)
-            try:
-                olat, olon = map(float, [item.origLat, item.origLong])
-            except (TypeError, ValueError):
-                logging.warn("Unable to create original coordinates for %s" % item)
-
-            societies.append(Society(
-                ext_id=item.id,
-                xd_id=item.xd_id,
-                original_name=item.ORIG_name_and_ID_in_this_dataset,
-                name=item.pref_name_for_society,
-                source=get_source(ds),
-                alternate_names=item.alt_names_by_society,
-                focal_year=item.main_focal_year,
-                hraf_link=item.HRAF_name_ID,
-                #chirila_link=item.CHIRILA_society_equivalent,
-                latitude=lat,
-                longitude=lon,
-                original_latitude=olat,
-                original_longitude=olon,
-            ))
-            logging.info("Saving society %s" % item.id)
+    for ds, rows in map_datasets(parse_societies, repos.datasets, workers=workers):
+        for row in rows:
+            societies.append(Society(source=get_source(ds), **row._asdict()))
+            logging.info("Saving society %s" % row.ext_id)
 
     Society.objects.bulk_create(societies)
 
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import logging
+from collections import OrderedDict
 
 from clldutils.text import split_text
 from dplace_app.models import Source
@@ -11,18 +12,23 @@ _SOURCE_CACHE = {}
 def get_source(ds):
     dsid = getattr(ds, 'id', ds)
     if dsid not in _SOURCE_CACHE:
-        try:
-            o = Source.objects.get(year=ds.year, author=ds.author)
-        except Source.DoesNotExist:
+        # References may have the same author and year as a dataset, but the dataset's
+        # source is created first:
+        o = Source.objects.filter(year=ds.year, author=ds.author).order_by('id').first()
+        if not o:
             o = ds.as_source()
             o.save()
         _SOURCE_CACHE[ds.id] = o
     return _SOURCE_CACHE[dsid]
 
 
-def load_references(repos):
-    keys = set()
-    for ds in repos.datasets:
+def read_references(datasets):
+    """
+    :return: `OrderedDict` mapping (author, year) pairs to the citation of their first \
+    occurrence in the references of the datasets.
+    """
+    res = OrderedDict()
+    for ds in datasets:
         for r in ds.references:
             if ':' in r.key:
                 # skip keys with page numbers.
@@ -31,12 +37,50 @@ def load_references(repos):
             # key is in the format Author, Year
             try:
                 author, year = split_text(r.key, separators=',', strip=True, brackets={})
-                if (author, year) not in keys:
-                    keys.add((author, year))
-                    reference = Source.objects.create(
-                        author=author, year=year, reference=r.citation)
-                    logging.info("Saved new reference %s (%s)"
-                                 % (reference.author, reference.year))
+                res.setdefault((author, year), r.citation)
             except Exception as e:  # pragma: no cover
-                logging.warn("Could not save reference for row %s: %s" % (str(r), e))
-    return len(keys)
+                logging.warn("Could not read reference for row %s: %s" % (str(r), e))
+    return res
+
+
+def load_references(repos):
+    refs = read_references(repos.datasets)
+    for (author, year), citation in refs.items():
+        try:
+            reference = Source.objects.create(author=author, year=year, reference=citation)
+            logging.info("Saved new reference %s (%s)"
+                         % (reference.author, reference.year))
+        except Exception as e:  # pragma: no cover
+            logging.warn("Could not save reference %s (%s): %s" % (author, year, e))
+    return len(refs)
+
+
+def update_references(repos):
+    """
+    Update the references to match the references of all datasets, for an incremental
+    reload. Sources created for references - rather than for datasets or trees - have
+    no name.
+
+    :return: number of created or updated references.
+    """
+    refs = read_references(repos.datasets)
+    existing = {(s.author, s.year): s for s in Source.objects.all()}
+    removed = sorted(
+        '%s (%s)' % key for key, s in existing.items() if not s.name and key not in refs)
+    if removed:
+        raise ValueError(
+            'removed references %s require a full reload' % ', '.join(removed))
+
+    count = 0
+    for (author, year), citation in refs.items():
+        source = existing.get((author, year))
+        if source is None:
+            Source.objects.create(author=author, year=year, reference=citation)
+        elif not source.name and source.reference != citation:
+            source.reference = citation
+            source.save()
+        else:
+            continue
+        count += 1
+        logging.info("Saved reference %s (%s)" % (author, year))
+    return count
@@ -1,16 +1,67 @@
 import re
-from collections import defaultdict
+import logging
+from collections import defaultdict, OrderedDict
+from multiprocessing import Pool
+from time import time
 
+from django.conf import settings
 from clldutils.misc import nfilter
 from nexus import NexusReader
-from ete3 import Tree
 from dplace_app.models import (
     Society, LanguageTree, Language, LanguageTreeLabels, LanguageTreeLabelsSequence,
 )
-from dplace_app.tree import update_newick
+from dplace_app.compact_tree import CompactTree
+from dplace_app.tree import update_newick, store_compact_tree
+from util import bulk_insert
 
 
-def load_trees(repos):
+def parse_tree(path):
+    """
+    Read the first tree from a NEXUS file.
+
+    :return: triple (Newick string, `list` of taxa, `CompactTree`).
+    """
+    reader = NexusReader(path)
+
+    # Remove '[&R]' from newick string
+    reader.trees.detranslate()
+    newick = re.sub(r'\[.*?\]', '', reader.trees.trees[0])
+    try:
+        newick = newick[newick.index('=') + 1:]
+    except ValueError:  # pragma: no cover
+        newick = newick
+    newick = str(newick)
+    # Parsing validates the Newick string; we store the result to not have to parse
+    # it again:
+    return newick, list(reader.trees.taxa), CompactTree.from_newick(newick)
+
+
+def parse_trees(paths, workers=0):
+    """
+    Parse NEXUS files - in a pool of `workers` processes if `workers` is not 0.
+
+    :return: `list` of the results of `parse_tree`, in the order of `paths`.
+    """
+    if not workers:
+        return [parse_tree(path) for path in paths]
+    pool = Pool(workers)
+    try:
+        return pool.map(parse_tree, paths, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def load_trees(repos, workers=None):
+    """
+    :param workers: Number of processes used to parse the tree files; defaults to the \
+    `DPLACE_LOAD_WORKERS` setting.
+    """
+    timings, start = OrderedDict(), time()
+
+    def phase(name):
+        timings[name] = time() - start - sum(timings.values())
+
     l_by_iso, l_by_glotto, l_by_name = \
         defaultdict(list), defaultdict(list), defaultdict(list)
 
@@ -28,54 +79,71 @@ def load_trees(repos):
         if taxon_name in l_by_name:
             return l_by_name[taxon_name]
 
-    sources, sequences, labels = {}, [], []
+    societies = {'language': defaultdict(list), 'xd_id': defaultdict(list)}
+    for society in Society.objects.order_by('id').only('id', 'ext_id', 'xd_id', 'language'):
+        societies['language'][society.language_id].append(society)
+        societies['xd_id'][society.xd_id].append(society)
+    phase('index')
+
+    objs = repos.phylogenies + repos.trees
+    parsed = parse_trees(
+        [obj.trees.as_posix() for obj in objs],
+        workers=getattr(settings, 'DPLACE_LOAD_WORKERS', 0) if workers is None else workers)
+    phase('parse')
+
+    sources, labels = {}, []
     trees = [
-        _load_tree(obj, get_language, sources, sequences, labels)
-        for obj in repos.phylogenies + repos.trees]
-    LanguageTreeLabelsSequence.objects.bulk_create(sequences)
+        _load_tree(obj, p, get_language, societies, sources, labels)
+        for obj, p in zip(objs, parsed)]
+    phase('trees')
+
+    # labels is a list of (label, [(society, fixed_order)]) pairs, thus we can insert
+    # labels, taxa and sequences with one bulk insert each - `bulk_insert` sets the
+    # primary keys of the labels on all database backends:
+    bulk_insert(LanguageTreeLabels, [label for label, _ in labels])
+    phase('labels')
+    bulk_insert(LanguageTree.taxa.through, [
+        LanguageTree.taxa.through(
+            languagetree_id=label.languageTree_id, languagetreelabels_id=label.id)
+        for label, _ in labels])
+    phase('taxa')
+    bulk_insert(LanguageTreeLabelsSequence, [
+        LanguageTreeLabelsSequence(
+            society_id=society.id, labels_id=label.id, fixed_order=fixed_order)
+        for label, seqs in labels for society, fixed_order in seqs])
+    phase('sequences')
 
+    labels = [label for label, _ in labels]
     for t in trees:
         update_newick(t, labels)
+    phase('prune')
+    logging.info('tree loading times: %s' % ', '.join(
+        '%s %.2fs' % item for item in timings.items()))
     return len(trees)
 
 
-def _load_tree(obj, get_language, sources, sequences, labels):
-    # now add languages to the tree
-    reader = NexusReader(obj.trees.as_posix())
-
-    tree = LanguageTree.objects.create(name=obj.id)
+def _load_tree(obj, parsed, get_language, societies, sources, labels):
+    newick, taxa, compact_tree = parsed
     source = sources.get((obj.author, obj.year))
     if not source:
         sources[(obj.author, obj.year)] = source = obj.as_source()
         source.save()
-    tree.source = source
+    tree = LanguageTree.objects.create(name=obj.id, source=source, newick_string=newick)
+    store_compact_tree(tree, compact_tree)
 
-    # Remove '[&R]' from newick string
-    reader.trees.detranslate()
-    newick = re.sub(r'\[.*?\]', '', reader.trees.trees[0])
-    try:
-        newick = newick[newick.index('=') + 1:]
-    except ValueError:  # pragma: no cover
-        newick = newick
-
-    tree.newick_string = str(newick)
-    Tree(tree.newick_string, format=1)
+    # now add languages to the tree
 
     def labels_for_language(taxon, language_id=None):
         language_id = language_id or taxon
         languages = get_language(language_id)
         if languages:
             for l in languages:
-                label = LanguageTreeLabels.objects.create(
-                    languageTree=tree, label=taxon, language=l)
-                labels.append(label)
-                tree.taxa.add(label)
-                for s in Society.objects.filter(language=l):
-                    sequences.append(LanguageTreeLabelsSequence(
-                        society=s, labels=label, fixed_order=0))
+                labels.append((
+                    LanguageTreeLabels(languageTree=tree, label=taxon, language=l),
+                    [(s, 0) for s in societies['language'][l.id]]))
 
     if obj.__class__.__name__ == 'Tree':
-        for taxon_name in reader.trees.taxa:
+        for taxon_name in taxa:
             labels_for_language(taxon_name)
     else:
         for item in obj.taxa:
@@ -87,16 +155,15 @@ def _load_tree(obj, get_language, sources, sequences, labels):
                     labels_for_language(name_on_tip, item['glottocode'])
                 continue
 
-            label = LanguageTreeLabels.objects.create(
-                languageTree=tree, label=name_on_tip)
-            labels.append(label)
-            tree.taxa.add(label)
-            for society in Society.objects.all().filter(xd_id__in=xd_ids):
+            sequences = []
+            for society in sorted(
+                    set(s for xd_id in xd_ids for s in societies['xd_id'][xd_id]),
+                    key=lambda s: s.id):
                 try:
                     f_order = len(society_ids) - society_ids.index(society.ext_id) - 1
                 except:
                     f_order = 0
-                sequences.append(LanguageTreeLabelsSequence(
-                    society=society, labels=label, fixed_order=f_order))
-    tree.save()
+                sequences.append((society, f_order))
+            labels.append((
+                LanguageTreeLabels(languageTree=tree, label=name_on_tip), sequences))
     return tree
@@ -1,6 +1,13 @@
 # coding: utf8
 from __future__ import unicode_literals
 import logging
+from functools import partial
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+from django.utils.six import text_type
 
 from dplace_app.models import GeographicRegion
 
@@ -23,8 +30,126 @@ def configure_logging(test=False):
     logger.addHandler(ch)
 
 
+def _materialize(func, ds):
+    return list(func(ds))
+
+
+def map_datasets(func, datasets, workers=None):
+    """
+    Parse the files of each dataset with `func` - in a pool of `workers` processes if
+    `workers` is not 0. The workers only parse files and ship the resulting rows back,
+    the database is written by the calling process only.
+
+    :param func: module level function, returning an iterable of picklable rows for a \
+    dataset.
+    :param workers: number of processes; defaults to the `DPLACE_LOAD_WORKERS` setting.
+    :return: iterator over pairs (dataset, rows), in the order of `datasets`.
+    """
+    if workers is None:
+        workers = getattr(settings, 'DPLACE_LOAD_WORKERS', 0)
+    if not workers:
+        for ds in datasets:
+            yield ds, func(ds)
+        return
+    datasets, pool = list(datasets), Pool(workers)
+    try:
+        for i, rows in enumerate(pool.imap(partial(_materialize, func), datasets)):
+            yield datasets[i], rows
+    finally:
+        pool.close()
+        pool.join()
+
+
 def load_regions(repos):
     regions = [r['properties'] for r in repos.read_json('geo', 'level2.json')['features']]
     GeographicRegion.objects.bulk_create([
         GeographicRegion(**{k.lower(): v for k, v in r.items()}) for r in regions])
     return len(regions)
+
+
+def _copy_field(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, float):
+        return repr(value)
+    if not isinstance(value, text_type):
+        value = text_type(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')\
+        .replace('\r', '\\r')
+
+
+class CopyStream(object):
+    """
+    File-like object providing rows in the text format of PostgreSQL's COPY, read
+    lazily from an iterable.
+    """
+    def __init__(self, rows):
+        self._lines = (
+            ('\t'.join(_copy_field(v) for v in row) + '\n').encode('utf8') for row in rows)
+        self._buffer = b''
+
+    def read(self, size=-1):
+        chunks, n = [self._buffer], len(self._buffer)
+        while size < 0 or n < size:
+            try:
+                line = next(self._lines)
+            except StopIteration:
+                break
+            chunks.append(line)
+            n += len(line)
+        data = b''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def bulk_insert(model, objs, copy=None):
+    """
+    Insert model instances, setting their primary keys.
+
+    On PostgreSQL, the ids are reserved from the table's sequence and the rows are
+    streamed with `COPY FROM STDIN`. Elsewhere - e.g. on SQLite - the ids following the
+    current maximum are assigned and the rows inserted with `bulk_create`; on
+    PostgreSQL the sequence is then advanced past these ids.
+
+    :param copy: whether to use COPY; defaults to whether the database is PostgreSQL.
+    :return: number of inserted rows.
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+    if copy is None:
+        copy = connection.vendor == 'postgresql'
+    table, fields = model._meta.db_table, model._meta.concrete_fields
+
+    with connection.cursor() as c:
+        if copy:
+            c.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+                "FROM generate_series(1, %s)",
+                [table, model._meta.pk.column, len(objs)])
+            ids = [r[0] for r in c.fetchall()]
+        else:
+            start = (model.objects.aggregate(m=Max('pk'))['m'] or 0) + 1
+            ids = range(start, start + len(objs))
+        for obj, id_ in zip(objs, ids):
+            obj.pk = id_
+
+        if not copy:
+            model.objects.bulk_create(objs, batch_size=1000)
+            if connection.vendor == 'postgresql':
+                c.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, %s), %s)",
+                    [table, model._meta.pk.column, ids[-1]])
+        else:
+            qn = connection.ops.quote_name
+            c.copy_expert(
+                'COPY {0} ({1}) FROM STDIN'.format(
+                    qn(table), ', '.join(qn(f.column) for f in fields)),
+                CopyStream(
+                    [f.get_db_prep_save(getattr(obj, f.attname), connection) for f in fields]
+                    for obj in objs))
+    return len(objs)
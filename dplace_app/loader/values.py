@@ -1,18 +1,65 @@
 # -*- coding: utf-8 -*-
 import logging
 import re
-
-from django.db import connection
+from collections import namedtuple
 
 from dplace_app.models import Society, Source, Value, Variable, CodeDescription
 from sources import get_source
+from util import bulk_insert, map_datasets
 
 
 BINFORD_REF_PATTERN = re.compile('(?P<author>[^0-9]+)(?P<year>[0-9]{4}a-z?):')
+CHUNK_SIZE = 10000
+
+
+# Compact representation of a row of data.csv, as shipped back by parsing workers.
+# `references` is a tuple of (author, year) pairs.
+ValueRow = namedtuple(
+    'ValueRow', 'soc_id var_id code comment year sub_case references')
+
+
+def parse_data(ds):
+    """
+    Parsing the values - including their references - does not need the database, thus
+    it can be done in a worker process, see `loader.util.map_datasets`.
+    """
+    for item in ds.data:
+        yield ValueRow(
+            item.soc_id,
+            item.var_id,
+            item.code,
+            item.comment,
+            item.year,
+            item.sub_case,
+            tuple(parse_references(item.references)) if ds.type == 'cultural' else ())
+
 
+def parse_references(refs):
+    for r in refs:
+        author, year = None, None
+        m = BINFORD_REF_PATTERN.match(r)
+        if m:
+            author, year = m.group('author').strip(), m.group('year')
+            if author.endswith(','):
+                author = author[:-1].strip()
+        else:
+            ref_short = r.split(",")
+            if len(ref_short) == 2:
+                author = ref_short[0].strip()
+                year = ref_short[1].strip().split(':')[0]
+        if author and year:
+            yield author, year
 
-def load_data(repos):
-    refs = []
+
+def load_data(repos, datasets=None, chunk_size=CHUNK_SIZE, workers=None):
+    """
+    Values are read lazily and inserted in chunks of `chunk_size`, so memory use does
+    not grow with the size of the datasets - unless the data files are parsed by
+    `workers` processes, which return all rows of a dataset at once.
+
+    :param datasets: `list` of datasets to load the values for; defaults to all.
+    """
+    datasets = repos.datasets if datasets is None else datasets
     societies = {s.ext_id: s for s in Society.objects.all()}
     kw = dict(
         sources={(s.author, s.year): s for s in Source.objects.all()},
@@ -20,77 +67,62 @@ def load_data(repos):
                       for vcd in CodeDescription.objects.all()})
 
     #
-    # To speed up the data load, we first delete all relevant objects, and then recreate
-    # them using bulk_create.
-    # Note that since we must rebuild the association table between values and sources
-    # as well, we must keep control over the inserted primary keys for values. To do so,
-    # we reset the id sequence as well.
+    # To speed up the data load, values and the association table between values and
+    # sources are inserted with COPY (on PostgreSQL), see `loader.util.bulk_insert`.
     #
-    #CulturalValue.objects.all().delete()
-    #with connection.cursor() as c:
-    #    for table in ['culturalvalue_references', 'culturalvalue']:
-    #        c.execute("ALTER SEQUENCE dplace_app_%s_id_seq RESTART WITH 1" % table)
-
     variables = {var.label: var for var in Variable.objects.all()}
-    objs = []
-    pk = 0
-    for ds in repos.datasets:
-        for item in ds.data:
-            if item.soc_id not in societies:
-                logging.warn('value for unknown society {0}'.format(item.soc_id))
+    chunk = []
+    for ds, rows in map_datasets(parse_data, datasets, workers=workers):
+        for row in rows:
+            if row.soc_id not in societies:
+                logging.warn('value for unknown society {0}'.format(row.soc_id))
                 continue
-            if item.var_id not in variables:
-                logging.warn('value for unknown variable {0}'.format(item.var_id))
+            if row.var_id not in variables:
+                logging.warn('value for unknown variable {0}'.format(row.var_id))
                 continue
             v, _refs = _load_data(
-                ds, item, get_source(ds), societies[item.soc_id], variables[item.var_id], **kw)
+                row, get_source(ds), societies[row.soc_id], variables[row.var_id], **kw)
             if v:
-                pk += 1
-                objs.append(Value(**v))
-                refs.extend([(pk, sid) for sid in _refs or []])
+                chunk.append((Value(**v), _refs))
+                if len(chunk) >= chunk_size:
+                    _insert_values(chunk)
+                    chunk = []
+    _insert_values(chunk)
+    return Value.objects.count()
 
-    Value.objects.bulk_create(objs, batch_size=1000)
 
-    with connection.cursor() as c:
-        c.executemany(
-            """\
-INSERT INTO dplace_app_value_references (value_id, source_id) VALUES (%s, %s)""", refs)
-    return Value.objects.count()
+def _insert_values(chunk):
+    """
+    Insert a chunk of values and their references.
+
+    :param chunk: `list` of pairs (`Value` instance, iterable of source ids).
+    """
+    bulk_insert(Value, [v for v, _ in chunk])
+    bulk_insert(Value.references.through, [
+        Value.references.through(value_id=v.pk, source_id=sid)
+        for v, _refs in chunk for sid in _refs or []])
 
 
-def _load_data(ds, val, source, society, variable, sources=None, descriptions=None):
+def _load_data(row, source, society, variable, sources=None, descriptions=None):
     v = dict(
         variable=variable,
-        comment=val.comment,
+        comment=row.comment,
         society=society,
         source=source,
-        coded_value=val.code,
-        coded_value_float=float(val.code)
-        if variable.data_type == 'Continuous' and val.code and val.code != 'NA' else None,
-        code=descriptions.get((variable.id, val.code)),
-        focal_year=val.year,
-        subcase=val.sub_case)
+        coded_value=row.code,
+        coded_value_float=float(row.code)
+        if variable.data_type == 'Continuous' and row.code and row.code != 'NA' else None,
+        code=descriptions.get((variable.id, row.code)),
+        focal_year=row.year,
+        subcase=row.sub_case)
 
     refs = set()
-    if ds.type == 'cultural':
-        for r in val.references:
-            author, year = None, None
-            m = BINFORD_REF_PATTERN.match(r)
-            if m:
-                author, year = m.group('author').strip(), m.group('year')
-                if author.endswith(','):
-                    author = author[:-1].strip()
-            else:
-                ref_short = r.split(",")
-                if len(ref_short) == 2:
-                    author = ref_short[0].strip()
-                    year = ref_short[1].strip().split(':')[0]
-            if author and year:
-                ref = sources.get((author, year))
-                if ref:
-                    refs.add(ref.id)
-                else:  # pragma: no cover
-                    logging.warn(
-                        "Could not find reference %s, %s in database, skipping reference"
-                        % (author, year))
+    for author, year in row.references:
+        ref = sources.get((author, year))
+        if ref:
+            refs.add(ref.id)
+        else:  # pragma: no cover
+            logging.warn(
+                "Could not find reference %s, %s in database, skipping reference"
+                % (author, year))
     return v, refs
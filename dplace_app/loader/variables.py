@@ -1,20 +1,78 @@
 # -*- coding: utf-8 -*-
 import logging
+from collections import namedtuple, OrderedDict
 
 from dplace_app.models import Variable, Category, CodeDescription
 from sources import get_source
+from util import bulk_insert, map_datasets
 
 
-def load_vars(repos):
-    categories, count = {}, 0
-    for ds in repos.datasets:
-        for var in ds.variables:
-            count += load_var(ds, var, categories)
-    return count
+# Compact representations of the variables and codes of a dataset, as shipped back by
+# parsing workers.
+VariableRow = namedtuple(
+    'VariableRow', 'id title definition type units category codes')
+CodeRow = namedtuple('CodeRow', 'code description name')
 
 
-def load_var(ds, var, categories):
-    variable = Variable.objects.create(
+def parse_variables(ds):
+    for var in ds.variables:
+        yield VariableRow(
+            var.id,
+            var.title,
+            var.definition,
+            var.type,
+            var.units,
+            var.category,
+            [CodeRow(c.code, c.description, c.name) for c in var.codes])
+
+
+def load_vars(repos, datasets=None, workers=None):
+    """
+    Variables, categories, the association table between variables and categories and
+    code descriptions are collected in memory and inserted with one bulk insert each,
+    see `loader.util.bulk_insert`.
+
+    :param datasets: `list` of datasets to load the variables for; defaults to all.
+    """
+    categories = {(c.type, c.name): c for c in Category.objects.all()}
+    new_categories, variables = [], []
+    datasets = repos.datasets if datasets is None else datasets
+    for ds, rows in map_datasets(parse_variables, datasets, workers=workers):
+        for var in rows:
+            variable, var_categories = load_var(ds, var, categories, new_categories)
+            variables.append((variable, var_categories, var.codes))
+
+    bulk_insert(Category, new_categories)
+    for c in new_categories:
+        logging.info("Created %s category: %s" % (c.type, c.name))
+    bulk_insert(Variable, [v for v, _, _ in variables])
+    bulk_insert(Variable.index_categories.through, [
+        Variable.index_categories.through(variable_id=v.pk, category_id=c.pk)
+        for v, cats, _ in variables for c in cats])
+
+    descriptions = []
+    for variable, _, codes in variables:
+        # Like `get_or_create`, a code listed more than once for a variable results in
+        # one code description, with the description of its last occurrence:
+        by_code = OrderedDict()
+        for code in codes:
+            cd = by_code.setdefault(
+                code.code, CodeDescription(variable_id=variable.pk, code=code.code))
+            cd.description = code.description
+            cd.short_description = code.name
+        for cd in by_code.values():
+            cd.read_code_number()
+            descriptions.append(cd)
+    bulk_insert(CodeDescription, descriptions)
+    logging.info("Created %s variables with %s codes" % (len(variables), len(descriptions)))
+    return len(variables)
+
+
+def load_var(ds, var, categories, new_categories):
+    """
+    :return: pair (unsaved `Variable` instance, `list` of its `Category` instances).
+    """
+    variable = Variable(
         name=var.title,
         type=ds.type,
         codebook_info=var.definition,
@@ -23,25 +81,13 @@ def load_var(ds, var, categories):
         label=var.id,
         source=get_source(ds))
 
+    var_categories = []
     for c in var.category:
         index_category = categories.get((ds.type, c))
         if not index_category:
-            index_category = categories[(ds.type, c)] = Category.objects.create(
-                name=c, type=ds.type)
-            logging.info("Created %s category: %s" % (ds.type, c))
-
-        if index_category not in variable.index_categories.all():
-            variable.index_categories.add(index_category)
-
-    for code in var.codes:
-        code_description, created = CodeDescription.objects.get_or_create(
-            variable=variable, code=code.code)
-        code_description.description = code.description
-        code_description.short_description = code.name
-        code_description.save()
-        logging.info(
-            ("Created CulturalCodeDescription: %s" % code_description).decode('utf8'))
-
-    variable.save()
-    logging.info("Created Variable: %s" % variable.label)
-    return 1
+            index_category = categories[(ds.type, c)] = Category(name=c, type=ds.type)
+            new_categories.append(index_category)
+
+        if index_category not in var_categories:
+            var_categories.append(index_category)
+    return variable, var_categories
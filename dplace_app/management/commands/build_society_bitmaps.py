@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dplace_app.postings import build_bitmaps
+
+
+class Command(BaseCommand):
+    help = "Build the per-code society bitmaps used to search categorical variables."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write("%s bitmaps built" % build_bitmaps())
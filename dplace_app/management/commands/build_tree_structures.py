@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dplace_app.tree import build_tree_structures, build_tree_index
+
+
+class Command(BaseCommand):
+    help = "Store the preprocessed structures of all trees and the society-label index."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write("%s tree structures built" % build_tree_structures())
+            self.stdout.write("%s society labels indexed" % build_tree_index())
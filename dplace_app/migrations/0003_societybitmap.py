@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 14:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dplace_app', '0002_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SocietyBitmap',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bitmap', models.BinaryField()),
+                ('code', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='society_bitmap', to='dplace_app.CodeDescription')),
+            ],
+        ),
+    ]
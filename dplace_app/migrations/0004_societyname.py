@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 15:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dplace_app', '0003_societybitmap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SocietyName',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=200)),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('has_values', models.BooleanField(default=False)),
+                ('society', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_names', to='dplace_app.Society')),
+            ],
+        ),
+    ]
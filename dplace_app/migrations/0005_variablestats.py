@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 15:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dplace_app', '0004_societyname'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariableStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('na_count', models.IntegerField(default=0)),
+                ('na_value', models.CharField(max_length=100, null=True)),
+                ('na_description', models.CharField(default='', max_length=500)),
+                ('min', models.FloatField(null=True)),
+                ('max', models.FloatField(null=True)),
+                ('quantiles', models.TextField(default='[]')),
+                ('histogram', models.TextField(default='[]')),
+                ('variable', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='dplace_app.Variable')),
+            ],
+        ),
+    ]
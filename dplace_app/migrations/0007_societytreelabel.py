@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 15:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dplace_app', '0006_languagetreestructure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SocietyTreeLabel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=255)),
+                ('fixed_order', models.PositiveSmallIntegerField()),
+                ('labels', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dplace_app.LanguageTreeLabels')),
+                ('language', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dplace_app.Language')),
+                ('languageTree', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dplace_app.LanguageTree')),
+                ('society', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tree_labels', to='dplace_app.Society')),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 15:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dplace_app', '0007_societytreelabel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadManifest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset', models.CharField(max_length=50)),
+                ('filename', models.CharField(max_length=50)),
+                ('sha1', models.CharField(max_length=40)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='loadmanifest',
+            unique_together=set([('dataset', 'filename')]),
+        ),
+    ]
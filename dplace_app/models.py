@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 from collections import defaultdict
+import json
 
 from django.core.urlresolvers import reverse
 from django.db import models
@@ -192,6 +193,56 @@ class CodeDescription(models.Model):
         ordering = ("variable", "code_number", "code")
 
 
+class VariableStats(models.Model):
+    """
+    Summary statistics of the values of a continuous variable, computed at load time,
+    see dplace_app.stats.
+    """
+    variable = models.OneToOneField('Variable', related_name='stats')
+    count = models.IntegerField(default=0)
+    # Values without a numeric value, i.e. coded as "NA" or similar:
+    na_count = models.IntegerField(default=0)
+    na_value = models.CharField(max_length=100, null=True)
+    na_description = models.CharField(max_length=500, default='')
+    min = models.FloatField(null=True)
+    max = models.FloatField(null=True)
+    # JSON encoded lists of the percentiles 0, 1, ..., 100 and of the number of values in
+    # each of the equal-width bins between min and max:
+    quantiles = models.TextField(default='[]')
+    histogram = models.TextField(default='[]')
+
+    def get_quantiles(self):
+        return json.loads(self.quantiles)
+
+    def get_histogram(self):
+        return json.loads(self.histogram)
+
+
+class SocietyBitmap(models.Model):
+    """
+    Compressed bitmap of the ids of the societies which have a value coded with a
+    particular code, see dplace_app.postings.
+    """
+    code = models.OneToOneField('CodeDescription', related_name='society_bitmap')
+    bitmap = models.BinaryField()
+
+
+class SocietyName(models.Model):
+    """
+    Search index for society names, see dplace_app.name_index.
+
+    Each row stores one suffix of the normalized - unaccented, lowercased - preferred
+    name or of one of the alternate names of a society, so that substring searches can
+    be evaluated as prefix lookups on the indexed `term`.
+    """
+    society = models.ForeignKey('Society', related_name='search_names')
+    term = models.CharField(max_length=200, db_index=True)
+    # Lower is better: matches at the start of a name rank before matches at the start
+    # of a word, before matches within a word; preferred names before alternate names.
+    rank = models.PositiveSmallIntegerField()
+    has_values = models.BooleanField(default=False)
+
+
 class Value(models.Model):
     """
     The values coded in the EA are typically discrete codes
@@ -301,6 +352,29 @@ class LanguageTree(models.Model):
     taxa = models.ManyToManyField('LanguageTreeLabels')
 
 
+class LanguageTreeStructure(models.Model):
+    """
+    Serialized `dplace_app.compact_tree.CompactTree` of a tree, stored when the tree is
+    loaded, so that the Newick string doesn't have to be parsed again.
+    """
+    languageTree = models.OneToOneField('LanguageTree', related_name='structure')
+    data = models.BinaryField()
+
+
+class SocietyTreeLabel(models.Model):
+    """
+    Denormalized join of `LanguageTreeLabelsSequence` and `LanguageTreeLabels`, mapping
+    societies to the trees and labels they appear with, see
+    dplace_app.tree.trees_for_societies.
+    """
+    society = models.ForeignKey('Society', related_name='tree_labels')
+    languageTree = models.ForeignKey('LanguageTree', related_name='+')
+    labels = models.ForeignKey('LanguageTreeLabels', related_name='+')
+    label = models.CharField(max_length=255)
+    language = models.ForeignKey('Language', null=True, related_name='+')
+    fixed_order = models.PositiveSmallIntegerField()
+
+
 class LanguageTreeLabels(models.Model):
     languageTree = models.ForeignKey('LanguageTree')
     label = models.CharField(max_length=255, db_index=True)
@@ -318,3 +392,28 @@ class LanguageTreeLabelsSequence(models.Model):
     
     class Meta:
         ordering = ("-fixed_order",)
+
+
+class DataVersion(models.Model):
+    """
+    Each completed run of the data loader adds a row, so that in-process indexes and
+    caches derived from the database can detect that they are stale.
+    """
+    loaded = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def current(cls):
+        return cls.objects.aggregate(v=models.Max('id'))['v'] or 0
+
+
+class LoadManifest(models.Model):
+    """
+    Hashes of the files of each dataset as of the last run of the data loader, used to
+    detect the datasets which must be reloaded, see dplace_app.loader.manifest.
+    """
+    dataset = models.CharField(max_length=50)
+    filename = models.CharField(max_length=50)
+    sha1 = models.CharField(max_length=40)
+
+    class Meta(object):
+        unique_together = ('dataset', 'filename')
@@ -0,0 +1,103 @@
+# coding: utf8
+"""
+Society name search.
+
+The preferred name and the alternate names of each society are normalized - unaccented
+and lowercased - and all suffixes of the normalized names are stored in the indexed
+`SocietyName.term` column. Thus a substring search for a normalized query is a prefix
+match `term LIKE 'query%'`, which is answered from the index rather than by scanning
+all societies. Whether a society has any values is precomputed, too.
+
+The index trades space for speed: a name of length L yields L rows, holding
+O(L * L) characters in total - terms are cut at `MAX_TERM_LENGTH`. Society names are
+short, so this is acceptable. Indexing only the suffixes starting at a word would be
+cheaper, but would no longer find substrings within words, e.g. 'herer' in
+'Ovaherero'.
+"""
+from __future__ import unicode_literals
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db.models import Min
+
+from dplace_app.models import Society, SocietyName, Value
+
+MAX_TERM_LENGTH = SocietyName._meta.get_field('term').max_length
+
+
+def normalize(s):
+    s = unicodedata.normalize('NFKD', '%s' % s)
+    s = ''.join(c for c in s if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', s.lower()).strip()
+
+
+def split_names(alternate_names):
+    return [n for n in re.split('[,;]', alternate_names or '') if n.strip()]
+
+
+def terms(name, preferred=True):
+    """
+    :return: generator of (term, rank) pairs for all suffixes of the normalized name.
+    """
+    name = normalize(name)
+    for i in range(len(name)):
+        if name[i] == ' ':
+            continue
+        position = 0 if i == 0 else (1 if name[i - 1] == ' ' else 2)
+        yield name[i:i + MAX_TERM_LENGTH], 2 * position + (0 if preferred else 1)
+
+
+def build_name_index():
+    """
+    (Re-)create the name index. Must be run whenever societies or values have been
+    loaded.
+    """
+    SocietyName.objects.all().delete()
+    with_values = set(Value.objects.values_list('society_id', flat=True).distinct())
+    rows = {}
+    for sid, name, alternate_names in Society.objects.values_list(
+            'id', 'name', 'alternate_names'):
+        names = [(name, True)] + [(n, False) for n in split_names(alternate_names)]
+        for n, preferred in names:
+            for term, rank in terms(n, preferred=preferred):
+                if rank < rows.get((sid, term), rank + 1):
+                    rows[(sid, term)] = rank
+    SocietyName.objects.bulk_create([
+        SocietyName(society_id=sid, term=term, rank=rank, has_values=sid in with_values)
+        for (sid, term), rank in sorted(rows.items())],
+        batch_size=1000)
+    return len(rows)
+
+
+def update_has_values(societies):
+    """
+    Update the `has_values` flags of the index rows of societies whose values have been
+    reloaded, without re-creating the rows.
+
+    :param societies: ids of the societies.
+    """
+    societies = set(societies)
+    with_values = set(Value.objects
+                      .filter(society_id__in=societies)
+                      .values_list('society_id', flat=True).distinct())
+    SocietyName.objects.filter(society_id__in=with_values).update(has_values=True)
+    SocietyName.objects.filter(society_id__in=societies - with_values)\
+        .update(has_values=False)
+    return len(societies)
+
+
+def search(q, limit=None):
+    """
+    :return: `list` of ids of the societies with values, whose name or alternate names \
+    contain `q`, ordered by rank.
+    """
+    q = normalize(q)[:MAX_TERM_LENGTH]
+    if not q:
+        return []
+    limit = limit or getattr(settings, 'DPLACE_NAME_SEARCH_LIMIT', 200)
+    return [r['society_id'] for r in SocietyName.objects
+            .filter(term__startswith=q, has_values=True)
+            .values('society_id', 'society__name')
+            .annotate(best=Min('rank'))
+            .order_by('best', 'society__name', 'society_id')[:limit]]
@@ -0,0 +1,80 @@
+# coding: utf8
+"""
+Posting lists of societies per code, stored as compressed bitmaps.
+
+Bit i of the bitmap for a CodeDescription is set if the society with id i has a value
+coded with this code. Bitmaps are packed with `numpy.packbits` and compressed with zlib.
+"""
+from __future__ import unicode_literals
+from itertools import groupby
+import zlib
+
+import numpy as np
+
+from dplace_app.models import CodeDescription, SocietyBitmap, Value
+
+
+def encode(society_ids):
+    bits = np.zeros(max(society_ids) + 1 if society_ids else 0, dtype=bool)
+    bits[list(society_ids)] = True
+    return zlib.compress(np.packbits(bits).tobytes())
+
+
+def decode(bitmap):
+    return np.frombuffer(zlib.decompress(bytes(bitmap)), dtype=np.uint8)
+
+
+def _combine(op, packed):
+    size = max(len(p) for p in packed)
+    res = np.pad(packed[0], (0, size - len(packed[0])), 'constant')
+    for p in packed[1:]:
+        res = op(res, np.pad(p, (0, size - len(p)), 'constant'))
+    return res
+
+
+def society_ids_for_codes(code_ids_by_variable):
+    """
+    Evaluate categorical filters using the bitmaps: societies must have one of the codes
+    for each variable, i.e. we compute the union of bitmaps within a variable and the
+    intersection across variables.
+
+    :param code_ids_by_variable: `dict` mapping variable ids to lists of code ids.
+    :return: `set` of society ids or `None` if bitmaps have not been built for all codes.
+    """
+    code_ids = set(cid for cids in code_ids_by_variable.values() for cid in cids)
+    bitmaps = {
+        code_id: decode(bitmap) for code_id, bitmap in
+        SocietyBitmap.objects.filter(code_id__in=code_ids).values_list('code_id', 'bitmap')}
+    if set(bitmaps) != code_ids:
+        return None
+
+    res = _combine(np.bitwise_and, [
+        _combine(np.bitwise_or, [bitmaps[cid] for cid in cids])
+        for cids in code_ids_by_variable.values()])
+    return set(int(i) for i in np.flatnonzero(np.unpackbits(res)))
+
+
+def build_bitmaps(variables=None):
+    """
+    (Re-)create the bitmaps for the codes. Must be run whenever values have been loaded.
+
+    :param variables: ids of the variables whose values have changed; all variables if \
+    `None`.
+    """
+    bitmaps = SocietyBitmap.objects.all()
+    values = Value.objects.filter(code__isnull=False)
+    codes = CodeDescription.objects.all()
+    if variables is not None:
+        bitmaps = bitmaps.filter(code__variable_id__in=variables)
+        values = values.filter(variable_id__in=variables)
+        codes = codes.filter(variable_id__in=variables)
+    bitmaps.delete()
+    societies = {
+        code_id: set(soc_id for _, soc_id in rows) for code_id, rows in groupby(
+            values.order_by('code_id').values_list('code_id', 'society_id'),
+            lambda r: r[0])}
+    SocietyBitmap.objects.bulk_create([
+        SocietyBitmap(code_id=code_id, bitmap=encode(societies.get(code_id, set())))
+        for code_id in codes.values_list('id', flat=True)],
+        batch_size=1000)
+    return SocietyBitmap.objects.count()
@@ -0,0 +1,112 @@
+# coding: utf8
+"""
+Builder for the SQL query selecting the ids of the societies matching a search.
+
+All values - ids and float bounds alike - are passed as query parameters, and lists of
+ids are matched with `= ANY(%s)`. Thus the SQL text only depends on the types of
+filters in a search, not on their values, and on PostgreSQL we can run it as a
+server-side prepared statement which is planned only once per connection. Other
+databases do not support `ANY` with a list parameter, so there the lists are expanded
+into `IN (...)` clauses.
+"""
+from __future__ import unicode_literals
+import hashlib
+import logging
+import re
+
+log = logging.getLogger('profile')
+
+ANY = re.compile(r'=\s*ANY\($')
+
+
+class SocietyIdQuery(object):
+    def __init__(self):
+        self.joins, self.where, self.join_params, self.where_params = [], [], [], []
+
+    def join(self, table, prefix, on, *params):
+        """
+        Add a join with `dplace_app_<table>`.
+
+        :param on: join condition, where `{0}` is replaced with the table alias.
+        :return: the table alias.
+        """
+        alias = '%s%s' % (prefix, len(self.joins))
+        self.joins.append('join dplace_app_%s as %s on %s' % (table, alias, on.format(alias)))
+        self.join_params.extend(params)
+        return alias
+
+    def filter(self, clause, *params):
+        self.where.append(clause)
+        self.where_params.extend(params)
+
+    @property
+    def params(self):
+        return self.join_params + self.where_params
+
+    @property
+    def sql(self):
+        return "select distinct s.id from dplace_app_society as s %s where %s" % (
+            ' '.join(self.joins), ' AND '.join(self.where))
+
+    @property
+    def shape(self):
+        return 'dplace_%s' % hashlib.md5(self.sql.encode('utf8')).hexdigest()[:16]
+
+    def execute(self, connection):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                self._execute_prepared(connection, cursor)
+            else:
+                cursor.execute(*self.expanded())
+            return [r[0] for r in cursor.fetchall()]
+
+    def expanded(self):
+        """
+        :return: pair (SQL, parameters) with the `= ANY(%s)` clauses for list parameters \
+        replaced by `IN (%s, ...)` clauses with one parameter per list item.
+        """
+        chunks, sql, params = self.sql.split('%s'), [], []
+        for chunk, param in zip(chunks, self.params):
+            if isinstance(param, (list, tuple)) and ANY.search(chunk):
+                sql.append(ANY.sub('IN (', chunk))
+                # `IN ()` is not valid SQL, and nothing is equal to NULL:
+                sql.append(', '.join(['%s'] * len(param)) or 'NULL')
+                params.extend(param)
+            else:
+                sql.extend([chunk, '%s'])
+                params.append(param)
+        sql.append(chunks[-1])
+        return ''.join(sql), params
+
+    def _execute_prepared(self, connection, cursor):
+        # Prepared statements live as long as the database session, so we keep track of
+        # the ones we created together with the underlying DB-API connection. Preparing
+        # a statement costs an extra round trip, which only pays off if the statement
+        # is executed again, thus we prepare a query shape the second time it is seen
+        # on a connection - with `CONN_MAX_AGE` 0, i.e. one connection per request,
+        # this will be rare.
+        prepared = getattr(connection, '_dplace_prepared', None)
+        if prepared is None or prepared[0] is not connection.connection:
+            prepared = connection._dplace_prepared = (connection.connection, set(), set())
+
+        name, params = self.shape, self.params
+        if name in prepared[1]:
+            log.info('plan cache hit: %s' % name)
+        elif name not in prepared[2]:
+            log.info('plan cache miss: %s' % name)
+            prepared[2].add(name)
+            cursor.execute(self.sql, params)
+            return
+        else:
+            log.info('plan cache miss: %s, preparing' % name)
+            sql = self.sql
+            for i in range(len(params)):
+                sql = sql.replace('%s', '$%s' % (i + 1), 1)
+            cursor.execute('PREPARE %s AS %s' % (name, sql))
+            prepared[1].add(name)
+
+        if params:
+            cursor.execute(
+                'EXECUTE %s (%s)' % (name, ', '.join(['%s'] * len(params))), params)
+        else:
+            cursor.execute('EXECUTE %s' % name)
@@ -1,3 +1,6 @@
+from io import BytesIO
+from itertools import chain
+
 from rest_framework import renderers
 from clldutils.dsv import UnicodeWriter
 
@@ -13,8 +16,15 @@ Binford and Johnson (2006), and Kirby et al. Submitted.
 
 
 class DPLACECSVResults(object):
-    def __init__(self, data):
+    """
+    Rows of the CSV export of a serialized SocietyResultSet.
+
+    Rows are computed lazily, one society at a time, so `societies` may also be an
+    iterator yielding the serialized societies as they are hydrated.
+    """
+    def __init__(self, data, societies=None):
         self.data = data
+        self.societies = data.get('societies', []) if societies is None else societies
         self.field_map = dict()
         self.field_names = [
             'Source',
@@ -31,13 +41,12 @@ class DPLACECSVResults(object):
             'ISO code',
             'Language family',
             ]
-        self.rows = []
         self.parse()
-        self.flatten()
 
     def __iter__(self):
-        for row in self.rows:
-            yield [row.get(field, '') for field in self.field_names]
+        for item in self.societies:
+            for row in self.rows_for_society(item):
+                yield [row.get(field, '') for field in self.field_names]
 
     def field_names_for_cultural_variable(self, variable):
         v = "%s %s" % (variable['label'], variable['name'])
@@ -82,118 +91,117 @@ class DPLACECSVResults(object):
                 self.field_names.append(field_names['name'])
                 self.field_names.append(field_names['comments'])
 
-    def flatten(self):
-        # data is a dictionary with a list of societies
-        for item in self.data.get('societies', []):
-            row = dict()
-            # Merge in society data
-            society = item['society']
-            row['Source'] = society['source']['name']
-            row['Preferred society name'] = society['name']
-            row['Society id'] = society['ext_id']
-            row['Cross-dataset id'] = society['xd_id']
-            row['Original society name'] = society['original_name']
-            row['Revised longitude'] = "" if society['location'] is None \
-                else society['location']['coordinates'][0]
-            row['Revised latitude'] = "" if society['location'] is None \
-                else society['location']['coordinates'][1]
-            row['Original longitude'] = "" if society['original_location'] is None \
-                else society['original_location']['coordinates'][0]
-            row['Original latitude'] = "" if society['original_location'] is None \
-                else society['original_location']['coordinates'][1]
-            if society['language'] is not None and 'name' in society['language']:
-                row['ISO code'] = society['language']['iso_code']
-                row['Glottolog language/dialect name'] = society['language']['name']
-                row['Glottolog language/dialect id'] = society['language']['glotto_code']
-                if 'family' in society['language'] \
-                    and 'name' in society['language']['family']:
-                        row['Language family'] = society['language']['family']['name']
-            else:
-                row['Glottolog language/dialect name'] = ""
-                row['Glottolog language/dialect id'] = ""
-                row['Language family'] = ""
-            
-            if society['region']:
-                row['Continent'] = society['region']['continent']
-                row['Region name'] = society['region']['region_nam']
-
-            # cultural
-            cultural_trait_values = item['variable_coded_values']
-            extra_rows = []  # Binford societies may have multiple values for one variable
-            for cultural_trait_value in cultural_trait_values:
-                # Figure out the column name
-                variable_id = cultural_trait_value['variable']
-                field_names = self.field_map['variable_descriptions'][variable_id]
-                if field_names['code'] in row:
-                    if 'code_description' in cultural_trait_value:
-                        try:
-                            description = \
-                                cultural_trait_value['code_description']['description']
-                        except:
-                            description = ""
-                    else:
-                        description = ""
-                    extra_rows.append(dict({
-                        'Preferred society name': society['name'],
-                        'Society id': society['ext_id'],
-                        'Cross-dataset id': society['xd_id'],
-                        'Original society name': society['original_name'],
-                        'Revised longitude': "" if society['location'] is None \
-                            else society['location']['coordinates'][0],
-                        'Revised latitude': "" if society['location'] is None \
-                            else society['location']['coordinates'][1],
-                        'Original longitude': "" if society['original_location'] is None \
-                            else society['original_location']['coordinates'][0],
-                        'Original latitude': "" if society['original_location'] is None \
-                            else society['original_location']['coordinates'][0],
-                        'Source': society['source']['name'],
-                        'ISO code': "" if society['language'] is None \
-                            else society['language']['iso_code'],
-                        'Glottolog language/dialect name': "" if (society['language'] is None or (society['language'] and 'name' not in society['language'])) \
-                            else society['language']['name'],
-                        'Glottolog language/dialect id': "" if society['language'] is None \
-                            else society['language']['glotto_code'],
-                        'Language family': "" if (society['language'] is None or (society['language'] and ('family' not in society['language'] or (society['language']['family'] and 'name' not in society['language']['family'])))) \
-                            else society['language']['family']['name'],
-                        
-                        field_names['code']: cultural_trait_value['coded_value'],
-                        field_names['description']: description,
-                        field_names['focal_year']: cultural_trait_value['focal_year'],
-                        field_names['comments']: cultural_trait_value['comment'],
-                        field_names['subcase']: cultural_trait_value['subcase'],
-                        field_names['sources']: ''.join(
-                            [x['author'] + '(' + x['year'] + '); '
-                             for x in cultural_trait_value['references']])
-                    }))
-                    continue
-
-                row[field_names['code']] = cultural_trait_value['coded_value']
-                row[field_names['focal_year']] = cultural_trait_value['focal_year']
+    def rows_for_society(self, item):
+        """
+        :return: `list` of the rows for one serialized society.
+        """
+        row = dict()
+        # Merge in society data
+        society = item['society']
+        row['Source'] = society['source']['name']
+        row['Preferred society name'] = society['name']
+        row['Society id'] = society['ext_id']
+        row['Cross-dataset id'] = society['xd_id']
+        row['Original society name'] = society['original_name']
+        row['Revised longitude'] = "" if society['location'] is None \
+            else society['location']['coordinates'][0]
+        row['Revised latitude'] = "" if society['location'] is None \
+            else society['location']['coordinates'][1]
+        row['Original longitude'] = "" if society['original_location'] is None \
+            else society['original_location']['coordinates'][0]
+        row['Original latitude'] = "" if society['original_location'] is None \
+            else society['original_location']['coordinates'][1]
+        if society['language'] is not None and 'name' in society['language']:
+            row['ISO code'] = society['language']['iso_code']
+            row['Glottolog language/dialect name'] = society['language']['name']
+            row['Glottolog language/dialect id'] = society['language']['glotto_code']
+            if 'family' in society['language'] \
+                and 'name' in society['language']['family']:
+                    row['Language family'] = society['language']['family']['name']
+        else:
+            row['Glottolog language/dialect name'] = ""
+            row['Glottolog language/dialect id'] = ""
+            row['Language family'] = ""
+        
+        if society['region']:
+            row['Continent'] = society['region']['continent']
+            row['Region name'] = society['region']['region_nam']
+
+        # cultural
+        cultural_trait_values = item['variable_coded_values']
+        extra_rows = []  # Binford societies may have multiple values for one variable
+        for cultural_trait_value in cultural_trait_values:
+            # Figure out the column name
+            variable_id = cultural_trait_value['variable']
+            field_names = self.field_map['variable_descriptions'][variable_id]
+            if field_names['code'] in row:
                 if 'code_description' in cultural_trait_value:
                     try:
-                        row[field_names['description']] = \
+                        description = \
                             cultural_trait_value['code_description']['description']
                     except:
-                        row[field_names['description']] = ''
-                row[field_names['comments']] = \
-                    cultural_trait_value['comment']
-                row [field_names['subcase']] = \
-                    cultural_trait_value['subcase']
-                row[field_names['sources']] = ''.join([
-                    x['author'] + '(' + x['year'] + '); '
-                    for x in cultural_trait_value['references']])
-            # environmental
-            environmental_values = item['environmental_values']
-            for environmental_value in environmental_values:
-                variable_id = environmental_value['variable']
-                field_names = self.field_map['environmental_variables'][variable_id]
-                row[field_names['name']] = environmental_value['value']
-                row[field_names['comments']] = environmental_value['comment']
-            # language - already have
-            #
-            self.rows.append(row)
-            for extra in extra_rows:
-                self.rows.append(extra)
+                        description = ""
+                else:
+                    description = ""
+                extra_rows.append(dict({
+                    'Preferred society name': society['name'],
+                    'Society id': society['ext_id'],
+                    'Cross-dataset id': society['xd_id'],
+                    'Original society name': society['original_name'],
+                    'Revised longitude': "" if society['location'] is None \
+                        else society['location']['coordinates'][0],
+                    'Revised latitude': "" if society['location'] is None \
+                        else society['location']['coordinates'][1],
+                    'Original longitude': "" if society['original_location'] is None \
+                        else society['original_location']['coordinates'][0],
+                    'Original latitude': "" if society['original_location'] is None \
+                        else society['original_location']['coordinates'][0],
+                    'Source': society['source']['name'],
+                    'ISO code': "" if society['language'] is None \
+                        else society['language']['iso_code'],
+                    'Glottolog language/dialect name': "" if (society['language'] is None or (society['language'] and 'name' not in society['language'])) \
+                        else society['language']['name'],
+                    'Glottolog language/dialect id': "" if society['language'] is None \
+                        else society['language']['glotto_code'],
+                    'Language family': "" if (society['language'] is None or (society['language'] and ('family' not in society['language'] or (society['language']['family'] and 'name' not in society['language']['family'])))) \
+                        else society['language']['family']['name'],
+                    
+                    field_names['code']: cultural_trait_value['coded_value'],
+                    field_names['description']: description,
+                    field_names['focal_year']: cultural_trait_value['focal_year'],
+                    field_names['comments']: cultural_trait_value['comment'],
+                    field_names['subcase']: cultural_trait_value['subcase'],
+                    field_names['sources']: ''.join(
+                        [x['author'] + '(' + x['year'] + '); '
+                         for x in cultural_trait_value['references']])
+                }))
+                continue
+
+            row[field_names['code']] = cultural_trait_value['coded_value']
+            row[field_names['focal_year']] = cultural_trait_value['focal_year']
+            if 'code_description' in cultural_trait_value:
+                try:
+                    row[field_names['description']] = \
+                        cultural_trait_value['code_description']['description']
+                except:
+                    row[field_names['description']] = ''
+            row[field_names['comments']] = \
+                cultural_trait_value['comment']
+            row [field_names['subcase']] = \
+                cultural_trait_value['subcase']
+            row[field_names['sources']] = ''.join([
+                x['author'] + '(' + x['year'] + '); '
+                for x in cultural_trait_value['references']])
+        # environmental
+        environmental_values = item['environmental_values']
+        for environmental_value in environmental_values:
+            variable_id = environmental_value['variable']
+            field_names = self.field_map['environmental_variables'][variable_id]
+            row[field_names['name']] = environmental_value['value']
+            row[field_names['comments']] = environmental_value['comment']
+        # language - already have
+        #
+        return [row] + extra_rows
 
 
 class DPLACECSVRenderer(renderers.BaseRenderer):
@@ -204,10 +212,22 @@ class DPLACECSVRenderer(renderers.BaseRenderer):
         "Renders a list of SocietyResultSets to CSV"
         if data is None:
             return ''
-        results = DPLACECSVResults(data)
-        with UnicodeWriter() as writer:
-            writer.writerow([CSV_PREAMBLE])
-            writer.writerow(results.field_names)
-            for row in results:
-                writer.writerow(row)
-        return writer.read()
+        return b''.join(iter_csv(data))
+
+
+def iter_csv(data, societies=None):
+    """
+    Generates the CSV export of a serialized SocietyResultSet line by line.
+
+    :param societies: optional iterator of serialized societies, overriding \
+    `data['societies']`.
+    """
+    results = DPLACECSVResults(data, societies=societies)
+    # We pass our own buffer to the writer, to be able to empty it after each row:
+    buf = BytesIO()
+    with UnicodeWriter(buf) as writer:
+        for row in chain([[CSV_PREAMBLE], results.field_names], results):
+            writer.writerow(row)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
@@ -0,0 +1,175 @@
+# coding: utf8
+"""
+In-process search engine for `find_societies`.
+
+The complete Value table is loaded once into NumPy arrays, sorted by variable, so that
+the 'c', 'e', 'l' and 'p' filters of a search can be evaluated as vectorized boolean
+masks rather than as one self-join on dplace_app_value per selected variable.
+"""
+from __future__ import unicode_literals
+from itertools import groupby
+import threading
+
+import numpy as np
+
+from dplace_app import models
+
+
+def parse_codes(codes):
+    """
+    Group the 'c' filters of a query by variable id.
+
+    Codes are serialized as "<variable id>-<code id>" for categorical variables and
+    as "<variable id>-<min>-<max>" for ranges of continuous variables.
+    """
+    res = {}
+    for variable, codes in groupby(
+        sorted(codes, key=lambda c: int(c.split('-')[0])),
+        key=lambda x: int(str(x).split('-')[0])
+    ):
+        res[variable] = [{
+            'id': None if (len(c.split('-')) > 2 or len(c.split('-')) == 1)
+            else int(c.split('-')[1]),
+            'min': None if len(c.split('-')) < 3 else float(c.split('-')[1]),
+            'max': None if len(c.split('-')) < 3 else float(c.split('-')[2])
+        } for c in list(codes)]
+    return res
+
+
+class SearchIndex(object):
+    """
+    Columnar snapshot of the values, indexed by (society, variable).
+
+    Value rows are sorted by variable, so the rows for one variable are a contiguous
+    slice of the row arrays. Each row stores the position of its society in the
+    society arrays, the code_id (categorical variables) and coded_value_float
+    (continuous variables).
+    """
+    def __init__(self, version=None):
+        self.version = version
+
+        socs = list(models.Society.objects
+                    .order_by('id').values_list('id', 'language_id', 'region_id'))
+        self.society_ids = np.array([s[0] for s in socs], dtype=np.int64)
+        self.language_ids = np.array(
+            [-1 if s[1] is None else s[1] for s in socs], dtype=np.int64)
+        self.region_ids = np.array(
+            [-1 if s[2] is None else s[2] for s in socs], dtype=np.int64)
+
+        self.continuous = set(models.Variable.objects
+                              .filter(data_type='Continuous')
+                              .values_list('id', flat=True))
+
+        rows = list(models.Value.objects
+                    .order_by('variable_id', 'society_id')
+                    .values_list(
+                        'variable_id', 'society_id', 'code_id', 'coded_value_float',
+                        'coded_value'))
+        variable_ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.society_pos = np.searchsorted(
+            self.society_ids, np.array([r[1] for r in rows], dtype=np.int64))
+        self.code_ids = np.array(
+            [-1 if r[2] is None else r[2] for r in rows], dtype=np.int64)
+        self.floats = np.array(
+            [np.nan if r[3] is None else r[3] for r in rows], dtype=np.float64)
+        self.is_na = np.array([r[4] == 'NA' for r in rows], dtype=bool)
+
+        self.slices = {}
+        if len(rows):
+            starts = np.flatnonzero(np.r_[True, variable_ids[1:] != variable_ids[:-1]])
+            ends = np.r_[starts[1:], len(rows)]
+            for start, end in zip(starts, ends):
+                self.slices[int(variable_ids[start])] = (int(start), int(end))
+
+    def _societies_with(self, variable_id, row_mask_func):
+        """
+        Returns a boolean mask over societies, True for the societies which have at
+        least one value for the variable for which `row_mask_func` holds.
+        """
+        res = np.zeros(len(self.society_ids), dtype=bool)
+        start, end = self.slices.get(variable_id, (0, 0))
+        if end > start:
+            rows = slice(start, end)
+            res[self.society_pos[rows][row_mask_func(rows)]] = True
+        return res
+
+    def _code_mask(self, variable_id, codes):
+        if variable_id in self.continuous:
+            include_NA = not all((c['min'] is not None) for c in codes)
+            ranges = [(c['min'], c['max']) for c in codes if c['min'] is not None]
+
+            def match(rows):
+                floats = self.floats[rows]
+                with np.errstate(invalid='ignore'):
+                    m = np.zeros(len(floats), dtype=bool)
+                    for vmin, vmax in ranges:
+                        m |= (floats >= vmin) & (floats <= vmax)
+                if include_NA:
+                    return m | self.is_na[rows]
+                return m & ~self.is_na[rows]
+        else:
+            ids = np.array([c['id'] for c in codes], dtype=np.int64)
+
+            def match(rows):
+                return np.in1d(self.code_ids[rows], ids)
+        return self._societies_with(variable_id, match)
+
+    def _environmental_mask(self, variable_id, criteria):
+        def match(rows):
+            floats = self.floats[rows]
+            m = np.ones(len(floats), dtype=bool)
+            with np.errstate(invalid='ignore'):
+                for _, operator, params in criteria:
+                    params = [float(p) for p in params]
+                    if operator == 'inrange':
+                        m &= (floats >= params[0]) & (floats <= params[1])
+                    elif operator == 'outrange':
+                        m &= (floats >= params[1]) & (floats <= params[0])
+                    elif operator == 'gt':
+                        m &= floats >= params[0]
+                    elif operator == 'lt':
+                        m &= floats <= params[0]
+            return m
+        return self._societies_with(variable_id, match)
+
+    def society_ids_for_query(self, query_dict):
+        """
+        Returns the sorted list of ids of the societies matching all filters in the
+        query, i.e. the same ids the SQL search in `result_set_from_query_dict` returns.
+        """
+        masks = []
+        if 'l' in query_dict:
+            masks.append(np.in1d(
+                self.language_ids, np.array(query_dict['l'], dtype=np.int64)))
+        if 'c' in query_dict:
+            for variable_id, codes in sorted(parse_codes(query_dict['c']).items()):
+                masks.append(self._code_mask(variable_id, codes))
+        if 'e' in query_dict:
+            for variable_id, criteria in groupby(
+                sorted(query_dict['e'], key=lambda c: c[0]), key=lambda x: x[0]
+            ):
+                masks.append(self._environmental_mask(int(variable_id), list(criteria)))
+        if 'p' in query_dict:
+            masks.append(np.in1d(
+                self.region_ids, np.array(query_dict['p'], dtype=np.int64)))
+
+        if not masks:
+            return []
+        return [int(i) for i in self.society_ids[np.logical_and.reduce(masks)]]
+
+
+_INDEX = None
+_LOCK = threading.Lock()
+
+
+def get_index():
+    """
+    Returns the search index for the current data, (re)building it when the data has
+    been reloaded since it was built.
+    """
+    global _INDEX
+    version = models.DataVersion.current()
+    with _LOCK:
+        if _INDEX is None or _INDEX.version != version:
+            _INDEX = SearchIndex(version=version)
+        return _INDEX
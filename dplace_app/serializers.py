@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 from rest_framework import serializers
 
 from dplace_app import models
@@ -175,19 +177,24 @@ class LanguageTreeSerializer(serializers.ModelSerializer):
     class Meta(object):
         model = models.LanguageTree
         fields = ('id', 'name', 'taxa', 'newick_string', 'source')
-        
 
-class SocietyResult(object):
+
+def pruned_tree_data(t):
     """
-    Encapsulates societies and their related search values for serializing
+    Compact representation of a tree returned by `dplace_app.tree.trees_for_societies`:
+    Rather than all taxa with nested societies, we only include the labels kept in the
+    pruned tree, mapped to lists of [society ext_id, fixed_order].
     """
-    def __init__(self, society):
-        self.society = society
-        self.variable_coded_values = set()
-        self.environmental_values = set()
-
-    def __eq__(self, other):
-        return self.society.id == other.society.id
+    return OrderedDict([
+        ('id', t.id),
+        ('name', t.name),
+        ('newick_string', t.newick_string),
+        ('partial', t.partial),
+        ('source', OrderedDict(
+            [(f, getattr(t.source, f)) for f in ('id', 'year', 'author', 'reference', 'name')])
+            if t.source else None),
+        ('labels', t.societies),
+    ])
 
 
 class VariableCode(object):
@@ -204,12 +211,13 @@ class VariableCode(object):
 
 class SocietyResultSet(object):
     """
-    Provides a mapping of Societies to SocietyResult objects
+    Collects the societies matching a search and the search criteria
     Used in building the search response
     """
 
     def __init__(self):
-        self.societies = set()
+        # serialized societies with their matching values, see dplace_app.hydration
+        self.societies = []
         # These are the column headers in the search results
         self.variable_descriptions = set()
         self.environmental_variables = set()
@@ -223,17 +231,11 @@ class VariableCodeSerializer(serializers.Serializer):
     variable = VariableSerializer()
 
 
-class SocietyResultSerializer(serializers.Serializer):
-    "Serializer for the SocietyResult object"
-    society = SocietyWithRegionSerializer()
-    variable_coded_values = ValueSerializer(many=True)
-    environmental_values = ValueSerializer(many=True)
-
-
 class SocietyResultSetSerializer(serializers.Serializer):
     "Serialize a set of society results and the search criteria"
-    # Results contains a society and variable values that matched
-    societies = SocietyResultSerializer(many=True)
+    # Results contains a society and variable values that matched, already serialized
+    # by dplace_app.hydration.hydrate_societies
+    societies = serializers.ListField(read_only=True)
     # These contain the search parameters
     # variable descriptions -> variable codes
     variable_descriptions = VariableCodeSerializer(many=True)
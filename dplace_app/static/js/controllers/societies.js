@@ -112,6 +112,8 @@ function SocietiesCtrl($scope, $location, $timeout, $http, searchModelService, c
         $scope.results.language_trees.phylogenies = [];
         $scope.results.language_trees.glotto_trees = [];
         $scope.results.language_trees.forEach(function(tree) {
+            // Trees which could not be pruned in time have no newick string:
+            if (tree.partial) return;
             if (tree.name.indexOf("global") != -1) $scope.results.language_trees.global_tree = tree;
             else if (tree.name.indexOf("glotto") != -1) {
                 $scope.results.language_trees.glotto_trees.push(tree);
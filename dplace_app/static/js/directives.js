@@ -259,24 +259,18 @@ angular.module('languagePhylogenyDirective', [])
                 }
                 var diagonal = rightAngleDiagonal();    
                 
-                taxa = {}
-                
-                include = scope.results.societies.map(function(s) { return s.society.ext_id; });
-                for (var i = 0; i < langTree.taxa.length; i++) {
-                   for (var t = 0; t < langTree.taxa[i].societies.length; t++) {
-                        //if (include.indexOf(langTree.taxa[i].societies[t].society.ext_id) != -1) {
-                            if (langTree.taxa[i].label in taxa) {
-                                continue; 
-                            }
-                            taxa[langTree.taxa[i].label] = langTree.taxa[i].societies[t];
-                            
-                       // }
-                    }
+                // Map tree labels to the names of the first of their societies:
+                var names = {};
+                scope.results.societies.forEach(function(s) { names[s.society.ext_id] = s.society.name; });
+                taxa = {};
+                for (var label in langTree.labels) {
+                    var ext_id = langTree.labels[label][0][0];
+                    if (ext_id in names) taxa[label] = names[ext_id];
                 }
                 nodes.forEach(function(node) {
                     node.rootDist = (node.parent ? node.parent.rootDist : 0) + (node.length || 0);
                     if (node.name in taxa) {
-                        node.name = taxa[node.name].society.name;
+                        node.name = taxa[node.name];
                     }
                 });
                 var rootDists = nodes.map(function(n) { return (n.rootDist); });
@@ -0,0 +1,68 @@
+# coding: utf8
+"""
+Summary statistics of continuous variables.
+
+The statistics are computed once, when the data is loaded, and stored in
+`VariableStats`, so that the `min_and_max` and `cont_variable` API endpoints don't
+have to scan all values of a variable.
+"""
+from __future__ import unicode_literals
+from itertools import groupby
+import json
+
+import numpy as np
+
+from dplace_app.models import Value, Variable, VariableStats
+
+HISTOGRAM_BINS = 100
+
+
+def variable_stats(variable_id, rows):
+    """
+    :param rows: iterable of (coded_value, coded_value_float, code description) tuples.
+    """
+    stats = VariableStats(variable_id=variable_id)
+    floats = []
+    for coded_value, coded_value_float, description in rows:
+        stats.count += 1
+        if coded_value_float is None:
+            stats.na_count += 1
+            if stats.na_value is None:
+                stats.na_value, stats.na_description = coded_value, description or ''
+        else:
+            floats.append(coded_value_float)
+
+    if floats:
+        floats = np.array(floats, dtype=float)
+        stats.min, stats.max = float(floats.min()), float(floats.max())
+        stats.quantiles = json.dumps(np.percentile(floats, range(101)).tolist())
+        stats.histogram = json.dumps(np.histogram(
+            floats, bins=HISTOGRAM_BINS, range=(stats.min, stats.max))[0].tolist())
+    return stats
+
+
+def build_variable_stats(variables=None):
+    """
+    (Re-)compute the statistics for continuous variables. Must be run whenever values
+    have been loaded.
+
+    :param variables: ids of the variables whose values have changed; all variables if \
+    `None`.
+    """
+    stats = VariableStats.objects.all()
+    continuous = Variable.objects.filter(data_type='Continuous')
+    if variables is not None:
+        stats = stats.filter(variable_id__in=variables)
+        continuous = continuous.filter(id__in=variables)
+    stats.delete()
+    variables = set(continuous.values_list('id', flat=True))
+    rows = {
+        vid: variable_stats(vid, (r[1:] for r in rows)) for vid, rows in groupby(
+            Value.objects.filter(variable_id__in=variables)
+            .order_by('variable_id', 'coded_value', 'id')
+            .values_list('variable_id', 'coded_value', 'coded_value_float', 'code__description'),
+            lambda r: r[0])}
+    VariableStats.objects.bulk_create(
+        [rows.get(vid) or VariableStats(variable_id=vid) for vid in sorted(variables)],
+        batch_size=1000)
+    return len(variables)
@@ -25,10 +25,12 @@ class Test(APITestCase):
         reverse_args = kw.pop('reverse_args', [])
         response = self.client.get(reverse(urlname, args=reverse_args), *args, **kw)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join(response.streaming_content) \
+            if response.streaming else response.content
         try:  # csv download doesn't return json
-            return json.loads(response.content)
+            return json.loads(content)
         except:
-            return response.content
+            return content
 
     def obj_in_results(self, obj, response):
         return getattr(obj, 'id', obj) in [x['id'] for x in response['results']]
@@ -70,6 +72,7 @@ class Test(APITestCase):
         self.assertIsInstance(response, dict)
         self.assertIn('min', response)
         self.assertIn('max', response)
+        self.assertEqual((response['min'], response['max']), ('1.0000', '2.0000'))
 
     def test_cont_variable(self):
         response = self.client.get('cont_variable')
@@ -82,6 +85,39 @@ class Test(APITestCase):
             'cont_variable',
             {'query': json.dumps(dict(bf_id=Variable.objects.get(label='2').id))})
         self.assertIsInstance(response, list)
+        self.assertEqual(len(response), 5)
+        self.assertEqual((response[0]['min'], response[-1]['max']), (56.8, 250.4))
+        for b1, b2 in zip(response[:-1], response[1:]):
+            self.assertEqual(b1['max'], b2['min'])
+
+        # The variable has the values 56.8 and 250.4:
+        bf_id = Variable.objects.get(label='2').id
+        for strategy, edges in [
+            ('quantile', [56.8, 153.6, 250.4]),
+            # Natural breaks put each value in a class of its own, so the second bin
+            # would be empty:
+            ('jenks', [56.8, 250.4]),
+            ('log', [56.8, 119.259046, 250.4]),
+        ]:
+            response = self.get_json('cont_variable', {'query': json.dumps(dict(
+                bf_id=bf_id, strategy=strategy, bins=2))})
+            self.assertEqual(len(response), len(edges) - 1)
+            for bin_, vmin, vmax in zip(response, edges[:-1], edges[1:]):
+                self.assertAlmostEqual(bin_['min'], vmin, places=5)
+                self.assertAlmostEqual(bin_['max'], vmax, places=5)
+
+        for query in [
+            dict(bf_id=bf_id, strategy='x'),
+            dict(bf_id=bf_id, bins='x'),
+            dict(bf_id=bf_id, bins=0),
+            dict(bf_id=bf_id, bins=101),
+        ]:
+            response = self.client.get(
+                reverse('cont_variable'), {'query': json.dumps(query)})
+            self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse('cont_variable'), {'query': json.dumps(dict(bf_id=bf_id, bins=3))})
+        self.assertEqual(response.status_code, 200)
 
     def test_geo_api(self):
         response = self.client.get(reverse('geographicregion-list'), format='json')
@@ -182,11 +218,49 @@ class Test(APITestCase):
                 CodeDescription.objects.get(code='1').id)]})})
         self.assertIn('Herero', response.decode('utf8'))
 
+    def test_csv_download_streaming(self):
+        query = {'query': json.dumps({'c': ['%s-%s' % (
+            CodeDescription.objects.get(code=c).variable.id,
+            CodeDescription.objects.get(code=c).id) for c in '14']})}
+        # By default, the complete result is rendered - and cached:
+        self.assertFalse(self.client.get(reverse('csv_download'), query).streaming)
+        expected = self.get_json('csv_download', query)
+        with self.settings(DPLACE_STREAMING_CSV=True):
+            self.assertTrue(self.client.get(reverse('csv_download'), query).streaming)
+            self.assertEqual(self.get_json('csv_download', query), expected)
+        self.assertEqual(len(expected.splitlines()), 4)
+
     def test_trees_from_societies(self):
         response = self.get_json(
-            'trees_from_societies',
-            {s.ext_id: s.id for s in Society.objects.all()})
-        self.assertEqual(response, [])
+            'trees_from_societies', {'s': [s.id for s in Society.objects.all()]})
+        self.assertEqual(
+            [(t['name'], t['newick_string']) for t in response],
+            [('author_year', '(Bar:0.227273,Bas:0.136364);'),
+             ('abkh1234.glotto.trees', '(aaaa1234:1);')])
+        self.assertEqual(
+            response[0]['labels'],
+            {'Bar': [['society1', 0], ['society3', 0]], 'Bas': [['society2', 0]]})
+        self.assertFalse(response[0]['partial'])
+        self.assertEqual(response[0]['source']['author'], 'author et al.')
+        self.assertEqual(
+            LanguageTreeStructure.objects.count(), LanguageTree.objects.count())
+
+        # Only the labels of the selected societies are returned:
+        response = self.get_json(
+            'trees_from_societies', {'s': Society.objects.get(ext_id='society2').id})
+        self.assertEqual(len(response), 1)
+        self.assertEqual(list(response[0]['labels']), ['Bas'])
+        self.assertEqual(response[0]['newick_string'], '(Bas:0.204545);')
+
+        # Other query parameters are ignored:
+        self.assertEqual(
+            self.get_json(
+                'trees_from_societies',
+                {'s': Society.objects.get(ext_id='society2').id, 'format': 'json'}),
+            response)
+
+        res = self.client.get(reverse('trees_from_societies'), {'s': 'x'})
+        self.assertEqual(res.status_code, 404)
 
     #
     # find societies:
@@ -226,6 +300,26 @@ class Test(APITestCase):
         self.assertFalse(
             self.society_in_results(Society.objects.get(ext_id='society2'), response))
 
+    def test_find_society_by_var_matching_values(self):
+        society = Society.objects.get(ext_id='society1')
+        code1 = CodeDescription.objects.get(code='1')
+        code4 = CodeDescription.objects.get(code='4')
+        Value.objects.create(
+            variable=code4.variable,
+            society=society,
+            coded_value='4',
+            code=code4,
+            source=society.source)
+
+        def values(**kw):
+            response = self.get_results(c=['%s-%s' % (code1.variable.id, code1.id)], **kw)
+            return [
+                sorted(v['coded_value'] for v in r['variable_coded_values'])
+                for r in response.data['societies']]
+
+        self.assertEqual(values(), [['1']])
+        self.assertEqual(values(all_values=[True]), [['1', '4']])
+
     def test_find_societies_by_var(self):
         serialized_codes = [
             '%s-%s' % (CodeDescription.objects.get(code=i).variable.id,
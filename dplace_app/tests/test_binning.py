@@ -0,0 +1,37 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+import numpy as np
+from django.test import TestCase
+
+from dplace_app.binning import bin_edges, STRATEGIES
+
+
+class Tests(TestCase):
+    def test_bin_edges(self):
+        values = np.array([1, 1, 2, 5, 6, 9], dtype=float)
+        self.assertEqual(list(bin_edges('equal', 4, 1, 9)), [1, 3, 5, 7, 9])
+        self.assertEqual(list(bin_edges('quantile', 2, 1, 9, values)), [1, 3.5, 9])
+        percentiles = np.percentile(values, range(101)).tolist()
+        self.assertTrue(np.allclose(
+            bin_edges('quantile', 4, 1, 9, percentiles=percentiles),
+            bin_edges('quantile', 4, 1, 9, values)))
+        self.assertEqual(list(bin_edges('jenks', 2, 1, 9, values)), [1, 5, 9])
+        self.assertTrue(np.allclose(bin_edges('log', 2, 1, 100), [1, 10, 100]))
+        self.assertTrue(np.allclose(bin_edges('log', 2, 0, 8), [0, 2, 8]))
+
+        for strategy in STRATEGIES:
+            self.assertEqual(list(bin_edges(strategy, 5, 2, 2, np.array([2.0]))), [2, 2])
+            edges = bin_edges(strategy, 5, 1, 9, values)
+            self.assertEqual((edges[0], edges[-1]), (1, 9))
+            self.assertTrue(np.all(np.diff(edges) > 0))
+
+    def test_jenks(self):
+        values = np.concatenate([np.arange(10), 100 + np.arange(10), 1000 + np.arange(10)])
+        self.assertEqual(
+            list(bin_edges('jenks', 3, values.min(), values.max(), values)),
+            [0, 100, 1000, 1009])
+        # Many distinct values are aggregated:
+        values = np.concatenate([np.linspace(0, 1, 1000), np.linspace(10, 11, 1000)])
+        edges = bin_edges('jenks', 2, 0, 11, values)
+        self.assertTrue(1 < edges[1] <= 10)
@@ -0,0 +1,106 @@
+# coding: utf8
+from __future__ import unicode_literals
+import json
+
+from django.core.cache import caches
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings, CaptureQueriesContext
+
+from dplace_app.models import *
+from dplace_app.tests.util import DataTestCase
+from dplace_app.cache import LRUCache, canonical_query, cache_key
+
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dplace-test-results',
+    },
+    'lru': {
+        'BACKEND': 'dplace_app.cache.LRUMemoryCache',
+        'LOCATION': 'dplace-test-lru',
+        'OPTIONS': {'MAX_BYTES': 1000},
+    },
+}
+
+
+class LRUTests(TestCase):
+    def test_lru(self):
+        cache = LRUCache(10)
+        cache.set('a', 1, 4)
+        cache.set('b', 2, 4)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3, 4)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.nbytes, 8)
+        self.assertFalse(cache.set('d', 4, 11))
+        cache.set('a', 5, 2)
+        self.assertEqual((cache.get('a'), cache.nbytes), (5, 6))
+        cache.clear()
+        self.assertEqual((len(cache), cache.nbytes), (0, 0))
+
+    @override_settings(CACHES=CACHES)
+    def test_backend(self):
+        cache = caches['lru']
+        cache.clear()
+        cache.set('k', {'x': 1})
+        self.assertEqual(cache.get('k'), {'x': 1})
+        self.assertFalse(cache.add('k', 2))
+        cache.set('big', 'x' * 2000)
+        self.assertIsNone(cache.get('big'))
+        for i in range(100):
+            cache.set('k%s' % i, 'x' * 50)
+        self.assertIsNone(cache.get('k'))
+        self.assertIsNotNone(cache.get('k99'))
+        cache.delete('k99')
+        self.assertFalse(cache.has_key('k99'))
+
+    def test_canonical_query(self):
+        self.assertEqual(
+            canonical_query({
+                'c': ['2-1.0-100', '1-3', '1-3'],
+                'l': [3, 1, 3],
+                'e': [[1, 'gt', ['2']]],
+                'all_values': [False]}),
+            canonical_query({
+                'c': ['1-3', '2-1-100.0'],
+                'l': [1, 3],
+                'e': [[1, 'gt', [2.0]]],
+                'all_values': False}))
+        self.assertNotEqual(
+            cache_key('find_societies', {'c': ['1-3']}),
+            cache_key('find_societies', {'c': ['1-4']}))
+
+
+@override_settings(CACHES=CACHES, DPLACE_RESULT_CACHE='results')
+class ResultCacheTests(DataTestCase):
+    def setUp(self):
+        super(ResultCacheTests, self).setUp()
+        caches['results'].clear()
+
+    def test_find_societies(self):
+        code = CodeDescription.objects.get(code='1')
+        lang = Society.objects.get(ext_id='society1').language
+        data = [
+            ('c', '%s-%s' % (code.variable.id, code.id)),
+            ('l', '%s' % lang.id),
+            ('l', '%s' % lang.id)]
+
+        def find(data):
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.get(reverse('find_societies'), data)
+            return json.loads(res.content.decode('utf8')), len(ctx.captured_queries)
+
+        res, queries = find(data)
+        self.assertEqual(len(res['societies']), 1)
+        cached, cached_queries = find(list(reversed(data)))
+        self.assertEqual(res, cached)
+        self.assertLess(cached_queries, queries)
+
+        # A new data version invalidates the cached results:
+        DataVersion.objects.create()
+        _, queries = find(data)
+        self.assertGreater(queries, cached_queries)
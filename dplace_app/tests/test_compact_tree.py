@@ -0,0 +1,76 @@
+# coding: utf8
+from __future__ import unicode_literals
+import random
+
+from ete3 import Tree
+from django.test import TestCase
+
+from dplace_app.compact_tree import CompactTree
+from dplace_app.tree import prune
+
+
+class Tests(TestCase):
+    def _compare(self, newick, names, const_depth=False, keep_root=False):
+        t = Tree(newick, format=1)
+        prune(t, names, const_depth=const_depth, keep_root=keep_root)
+        self.assertEqual(
+            CompactTree.from_newick(newick).prune(
+                names, const_depth=const_depth, keep_root=keep_root),
+            t.write(format=1))
+
+    def test_structure(self):
+        t = CompactTree.from_newick('((A:2,B)C,D)root;')
+        self.assertEqual(t.names, ['root', 'C', 'A', 'B', 'D'])
+        self.assertEqual(list(t.parent), [-1, 0, 1, 1, 0])
+        self.assertEqual(list(t.children(0)), [1, 4])
+        self.assertEqual(list(t.depth), [0, 1, 2, 2, 1])
+        self.assertEqual(list(t.postorder_index), [4, 2, 0, 1, 3])
+        self.assertEqual(list(t.end), [4, 3, 2, 3, 4])
+        self.assertEqual([t.lca(2, 3), t.lca(3, 4), t.lca(2, 1), t.lca(4, 4)], [1, 0, 1, 4])
+        self.assertEqual(list(t.induced_subtree({2, 4}).items()), [(0, None), (2, 0), (4, 0)])
+        self.assertEqual(t.dist[2], 2)
+        self.assertEqual(t.leaves(1), [2, 3])
+        self.assertIsNone(t.prune(['X']))
+
+    def test_dumps(self):
+        t = CompactTree.from_newick('(((A,B)C,D)E,(F,G)H)root;')
+        t2 = CompactTree.loads(t.dumps())
+        self.assertEqual(t2.names, t.names)
+        self.assertEqual(t2.name_index, t.name_index)
+        self.assertEqual(len(t2.sparse_table), len(t.sparse_table))
+        self.assertEqual(t2.lca(2, 6), 0)
+        for names in [['A', 'B', 'D'], ['A', 'F'], ['G']]:
+            self.assertEqual(t2.prune(names), t.prune(names))
+
+    def test_lca(self):
+        rnd = random.Random(1)
+        t = Tree()
+        t.populate(200, random_branches=True)
+        ct = CompactTree(t)
+        nodes = list(t.traverse('preorder'))
+        for _ in range(200):
+            i, j = rnd.randrange(ct.size), rnd.randrange(ct.size)
+            self.assertIs(nodes[ct.lca(i, j)], nodes[i].get_common_ancestor(nodes[j]))
+
+    def test_prune(self):
+        newick = '(((((A,B)C)D,E)F,G)H,(I,J)K)root;'
+        for names in [['A', 'B'], ['A', 'B', 'C'], ['A', 'I'], ['E'], ['root'], ['F', 'A']]:
+            for const_depth in [True, False]:
+                for keep_root in [True, False]:
+                    self._compare(newick, names, const_depth, keep_root)
+
+    def test_random(self):
+        rnd = random.Random(42)
+        for _ in range(300):
+            t = Tree()
+            t.populate(rnd.randint(2, 30), random_branches=True)
+            for i, node in enumerate(t.traverse()):
+                node.name = 'n%s' % (i if rnd.random() < 0.8 else rnd.randint(0, 5))
+                node.dist = round(rnd.random() * 3, rnd.choice([0, 1, 6]))
+            newick = t.write(format=1)
+            names = [n.name for n in Tree(newick, format=1).iter_descendants()]
+            self._compare(
+                newick,
+                rnd.sample(names, rnd.randint(1, min(6, len(names)))),
+                const_depth=rnd.random() < 0.5,
+                keep_root=rnd.random() < 0.5)
@@ -0,0 +1,47 @@
+# coding: utf8
+from __future__ import unicode_literals
+import json
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from dplace_app.models import *
+from dplace_app.tests.util import DataTestCase
+from dplace_app.hydration import hydrate_societies
+from dplace_app.serializers import SocietyWithRegionSerializer, ValueSerializer
+
+
+class Tests(DataTestCase):
+    def _json(self, obj):
+        return json.loads(json.dumps(obj))
+
+    def test_hydrate_societies(self):
+        cvars = [v.id for v in Variable.objects.filter(type='cultural')]
+        evars = [v.id for v in Variable.objects.filter(type='environmental')]
+        societies = Society.objects.order_by('id')
+        soc_ids = [s.id for s in societies]
+        with CaptureQueriesContext(connection) as ctx:
+            res = hydrate_societies(soc_ids, cvars, evars)
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertEqual(len(res), societies.count())
+
+        for soc, item in zip(societies, res):
+            self.assertEqual(
+                self._json(item['society']),
+                self._json(SocietyWithRegionSerializer().to_representation(soc)))
+            for key, variables in [
+                ('variable_coded_values', cvars), ('environmental_values', evars)
+            ]:
+                self.assertEqual(
+                    sorted(self._json(item[key]), key=lambda v: v['id']),
+                    self._json(ValueSerializer(
+                        soc.value_set.filter(variable_id__in=variables).order_by('id'),
+                        many=True).data))
+
+    def test_no_variables(self):
+        soc_ids = [s.id for s in Society.objects.all()[:2]]
+        with CaptureQueriesContext(connection) as ctx:
+            res = hydrate_societies(soc_ids)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(len(res), 2)
+        self.assertEqual(res[0]['variable_coded_values'], [])
@@ -3,6 +3,7 @@ from __future__ import unicode_literals, print_function, division
 from unittest import TestCase
 
 import attr
+from clldutils.path import Path
 
 
 class Tests(TestCase):
@@ -20,3 +21,15 @@ class Tests(TestCase):
 
         self.assertEqual(
             Variable(**kwargs(category='ab, cd', type='Ordinal')).category, ['Ab', 'Cd'])
+
+    def test_parse_trees(self):
+        from dplace_app.loader.tree import parse_trees
+
+        data = Path(__file__).parent.joinpath('data')
+        paths = [p.as_posix() for p in sorted(data.joinpath('trees').glob('*.trees'))] + \
+            [data.joinpath('phylogenies', 'author_year', 'summary.trees').as_posix()]
+        serial, parallel = parse_trees(paths), parse_trees(paths, workers=2)
+        self.assertEqual(len(serial), 3)
+        for (n1, taxa1, t1), (n2, taxa2, t2) in zip(serial, parallel):
+            self.assertEqual((n1, taxa1), (n2, taxa2))
+            self.assertEqual(t1.prune(taxa1), t2.prune(taxa2))
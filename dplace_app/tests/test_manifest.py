@@ -0,0 +1,94 @@
+# coding: utf8
+from __future__ import unicode_literals
+import shutil
+
+from clldutils.path import TemporaryDirectory
+
+from dplace_app.models import *
+from dplace_app.tests.util import DataTestCase, DATA
+from dplace_app.load import load, Repos
+from dplace_app.loader.manifest import changed_files
+from dplace_app import name_index
+
+
+class Tests(DataTestCase):
+    def _edit(self, repos, dataset, name, old, new):
+        path = repos.joinpath('datasets', dataset, name)
+        with open(path.as_posix(), 'rb') as fp:
+            content = fp.read().decode('utf8')
+        with open(path.as_posix(), 'wb') as fp:
+            fp.write(content.replace(old, new).encode('utf8'))
+
+    def test_incremental_load(self):
+        with TemporaryDirectory() as tmp:
+            repos = tmp.joinpath('data')
+            shutil.copytree(DATA.as_posix(), repos.as_posix())
+            self.assertEqual(changed_files(Repos(repos)), {})
+            version, nvalues = DataVersion.current(), Value.objects.count()
+            ids = set(Value.objects.filter(source__name='dscultural').values_list('id', flat=True))
+            derived = lambda: [
+                set(SocietyTreeLabel.objects.values_list('id', flat=True)),
+                set(VariableStats.objects.filter(variable__source__name='dscultural')
+                    .values_list('id', flat=True))]
+            unchanged = derived()
+
+            # Nothing to do:
+            load(repos, incremental=True)
+            self.assertEqual(DataVersion.current(), version)
+
+            self._edit(repos, 'dsenvironmental', 'data.csv', 'Rainfall,2.0,2', 'Rainfall,3.0,2')
+            self.assertEqual(changed_files(Repos(repos)), {'dsenvironmental': {'data'}})
+            load(repos, incremental=True)
+            self.assertEqual(Value.objects.count(), nvalues)
+            self.assertEqual(
+                VariableStats.objects.get(variable__label='Rainfall').max, 3.0)
+            self.assertGreater(DataVersion.current(), version)
+            self.assertEqual(changed_files(Repos(repos)), {})
+            # Values of other datasets are not touched:
+            self.assertEqual(set(
+                Value.objects.filter(source__name='dscultural').values_list('id', flat=True)),
+                ids)
+            # Neither are the derived data of trees and other datasets:
+            self.assertEqual(derived(), unchanged)
+
+            # A society without values is found by name search once it has values:
+            self.assertEqual(name_index.search('pokomo'), [])
+            self._edit(
+                repos, 'dsenvironmental', 'data.csv',
+                'Rainfall,3.0,2,,,', 'Rainfall,3.0,2,,,\nsociety4,,,Rainfall,5.0,1,,,')
+            load(repos, incremental=True)
+            nvalues += 1
+            self.assertEqual(Value.objects.count(), nvalues)
+            self.assertEqual(
+                name_index.search('pokomo'), [Society.objects.get(ext_id='society4').id])
+            # ... and no longer found once its last value is removed:
+            self._edit(repos, 'dsenvironmental', 'data.csv', '\nsociety4,,,Rainfall,5.0,1,,,', '')
+            load(repos, incremental=True)
+            self.assertEqual(name_index.search('pokomo'), [])
+            self._edit(
+                repos, 'dsenvironmental', 'data.csv',
+                'Rainfall,3.0,2,,,', 'Rainfall,3.0,2,,,\nsociety4,,,Rainfall,5.0,1,,,')
+            load(repos, incremental=True)
+
+            self._edit(repos, 'dsenvironmental', 'variables.csv', 'Precipitation', 'Rain')
+            load(repos, incremental=True)
+            self.assertEqual(Value.objects.count(), nvalues)
+            self.assertEqual(Variable.objects.get(label='Rainfall').codebook_info, 'Rain')
+            self.assertEqual(Category.objects.filter(name='Climate').count(), 1)
+
+            self._edit(repos, 'dscultural', 'references.csv', 'Title. Place.', 'New title.')
+            load(repos, incremental=True)
+            self.assertEqual(
+                Source.objects.get(author='Name', year='1924').reference,
+                'Name, M. 1924. New title.')
+            self.assertEqual(Value.objects.count(), nvalues)
+
+            # Removed references may be linked to values of any dataset:
+            self._edit(repos, 'dscultural', 'references.csv', '"Name, 1894"', '"Name: 1894"')
+            with self.assertRaises(ValueError):
+                load(repos, incremental=True)
+            self._edit(repos, 'dscultural', 'references.csv', '"Name: 1894"', '"Name, 1894"')
+
+            self._edit(repos, 'dscultural', 'societies.csv', 'society1', 'societyX')
+            with self.assertRaises(ValueError):
+                load(repos, incremental=True)
@@ -0,0 +1,39 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from dplace_app.models import *
+from dplace_app.tests.util import DataTestCase
+from dplace_app import name_index
+
+
+class Tests(DataTestCase):
+    def _search(self, q, **kw):
+        return [Society.objects.get(id=i).ext_id for i in name_index.search(q, **kw)]
+
+    def test_normalize(self):
+        self.assertEqual(name_index.normalize(' Söciety  ONE '), 'society one')
+        self.assertEqual(name_index.split_names('Damara, Ovaherero'), ['Damara', ' Ovaherero'])
+
+    def test_search(self):
+        self.assertTrue(SocietyName.objects.filter(has_values=False).exists())
+        self.assertEqual(self._search('SÖCIETY1'), ['society1'])
+        # Substring of an alternate name:
+        self.assertEqual(self._search('herer'), ['society1'])
+        # Societies without values are not found:
+        self.assertEqual(self._search('pokomo'), [])
+        self.assertEqual(
+            sorted(self._search('soc')), ['society1', 'society2', 'society3'])
+        self.assertEqual(len(self._search('soc', limit=1)), 1)
+        # Matches at the start of a name rank before matches within a name:
+        self.assertEqual(self._search('iriama'), ['society3'])
+        Society.objects.filter(ext_id='society2').update(alternate_names='Iriama')
+        name_index.build_name_index()
+        self.assertEqual(self._search('iriama'), ['society2', 'society3'])
+        self.assertEqual(self._search(' '), [])
+
+        with CaptureQueriesContext(connection) as ctx:
+            name_index.search('society')
+        self.assertEqual(len(ctx.captured_queries), 1)
@@ -0,0 +1,60 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+import numpy as np
+from six import StringIO
+from django.core.management import call_command
+
+from dplace_app.models import *
+from dplace_app.tests.util import DataTestCase
+from dplace_app.api_views import result_set_from_query_dict
+from dplace_app import postings
+
+
+class Tests(DataTestCase):
+    def _society_ids(self, query):
+        return sorted(
+            r['society']['id'] for r in result_set_from_query_dict(query).societies)
+
+    def test_encode(self):
+        def roundtrip(ids):
+            return list(np.flatnonzero(np.unpackbits(postings.decode(postings.encode(ids)))))
+
+        self.assertEqual(roundtrip({1, 8, 17}), [1, 8, 17])
+        self.assertEqual(roundtrip(set()), [])
+
+    def test_search(self):
+        var1 = Variable.objects.get(label='1')
+        var2 = Variable.objects.get(label='2')
+        code = lambda c: CodeDescription.objects.get(variable=var1, code=c)
+        queries = [
+            {'c': ['%s-%s' % (var1.id, code('1').id)]},
+            {'c': ['%s-%s' % (var1.id, code(c).id) for c in '14']},
+            {'c': ['%s-%s' % (var1.id, code('9').id)]},
+            {'c': ['%s-%s' % (var1.id, code(c).id) for c in '14'] + [
+                '%s-0.0-100' % var2.id]},
+            {'c': ['%s-%s' % (var1.id, code(c).id) for c in '14'],
+             'l': [l.id for l in Language.objects.all()[:1]]},
+        ]
+        expected = [self._society_ids(q) for q in queries]
+
+        call_command('build_society_bitmaps', stdout=StringIO())
+        self.assertEqual(SocietyBitmap.objects.count(), CodeDescription.objects.count())
+        self.assertEqual(
+            postings.society_ids_for_codes({var1.id: [code('1').id]}),
+            {Society.objects.get(ext_id='society1').id})
+        self.assertEqual([self._society_ids(q) for q in queries], expected)
+
+    def test_build_bitmaps_for_variables(self):
+        postings.build_bitmaps()
+        var1 = Variable.objects.get(label='1')
+        bitmap_ids = lambda qs: set(qs.values_list('id', flat=True))
+        var1_ids = bitmap_ids(SocietyBitmap.objects.filter(code__variable=var1))
+        other_ids = bitmap_ids(SocietyBitmap.objects.exclude(code__variable=var1))
+        # Only the bitmaps for the codes of the passed variables are re-created:
+        postings.build_bitmaps(variables=[var1.id])
+        self.assertEqual(
+            bitmap_ids(SocietyBitmap.objects.exclude(code__variable=var1)), other_ids)
+        new_ids = bitmap_ids(SocietyBitmap.objects.filter(code__variable=var1))
+        self.assertEqual(len(new_ids), len(var1_ids))
+        self.assertFalse(new_ids & var1_ids)
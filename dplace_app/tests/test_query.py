@@ -0,0 +1,50 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+from django.db import connection
+from django.test import TestCase
+
+from dplace_app.models import Society
+from dplace_app.query import SocietyIdQuery
+
+
+class Tests(TestCase):
+    def _query(self, ids, vmin):
+        query = SocietyIdQuery()
+        alias = query.join(
+            'value', 'cv', '{0}.society_id = s.id AND {0}.variable_id = %s', 5)
+        query.filter('s.id = ANY(%s)', ids)
+        query.filter('{0}.coded_value_float >= %s'.format(alias), vmin)
+        return query
+
+    def test_shape(self):
+        q1, q2 = self._query([1, 2], 0.1), self._query([3], 1.0 / 3)
+        self.assertEqual(q1.sql, q2.sql)
+        self.assertEqual(q1.shape, q2.shape)
+        self.assertEqual(q2.params, [5, [3], 1.0 / 3])
+
+    def test_execute(self):
+        soc = Society.objects.create(ext_id='s1', name='Society')
+        query = SocietyIdQuery()
+        query.filter('s.id = ANY(%s)', [soc.id])
+        self.assertEqual(query.execute(connection), [soc.id])
+        self.assertEqual(self._query([soc.id], 0.5).execute(connection), [])
+
+        if connection.vendor == 'postgresql':
+            # Query shapes are prepared the second time they are executed:
+            self.assertNotIn(query.shape, connection._dplace_prepared[1])
+            self.assertEqual(query.execute(connection), [soc.id])
+            self.assertIn(query.shape, connection._dplace_prepared[1])
+            self.assertEqual(query.execute(connection), [soc.id])
+
+        query = SocietyIdQuery()
+        query.filter('s.id = ANY(%s)', [])
+        self.assertEqual(query.execute(connection), [])
+
+    def test_expanded(self):
+        sql, params = self._query([1, 2], 0.5).expanded()
+        self.assertIn('s.id IN (%s, %s)', sql)
+        self.assertEqual(params, [5, 1, 2, 0.5])
+        query = SocietyIdQuery()
+        query.filter('s.id = ANY(%s)', [])
+        self.assertEqual(query.expanded(), (query.sql.replace('= ANY(%s)', 'IN (NULL)'), []))
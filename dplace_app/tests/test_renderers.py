@@ -1,6 +1,6 @@
 from django.test import TestCase
 
-from dplace_app.renderers import DPLACECSVResults, DPLACECSVRenderer
+from dplace_app.renderers import DPLACECSVResults, DPLACECSVRenderer, iter_csv
 
 
 class DPLACECSVResultsTestCase(TestCase):
@@ -39,3 +39,7 @@ class DPLACECSVRendererTestCase(TestCase):
     def test_safe_handling_of_no_data(self):
         assert self.renderer.render(data=None) == ''
 
+    def test_iter_csv(self):
+        lines = list(iter_csv({}, societies=iter([])))
+        assert len(lines) == 2
+        assert b''.join(lines) == self.renderer.render(data={})
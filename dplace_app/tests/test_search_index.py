@@ -0,0 +1,53 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+from django.test.utils import override_settings
+
+from dplace_app.models import *
+from dplace_app.tests.util import DataTestCase
+from dplace_app.api_views import result_set_from_query_dict
+from dplace_app import search_index
+
+
+class Tests(DataTestCase):
+    def _society_ids(self, query):
+        return sorted(
+            r['society']['id'] for r in result_set_from_query_dict(query).societies)
+
+    def _compare(self, query):
+        expected = self._society_ids(query)
+        with override_settings(DPLACE_SEARCH_INDEX=True):
+            self.assertEqual(self._society_ids(query), expected)
+        return expected
+
+    def test_queries(self):
+        var1 = Variable.objects.get(label='1')
+        var2 = Variable.objects.get(label='2')
+        rainfall = Variable.objects.get(name='Rainfall')
+        code = lambda c: '%s-%s' % (var1.id, CodeDescription.objects.get(
+            variable=var1, code=c).id)
+
+        self.assertEqual(len(self._compare({'c': [code('1')]})), 1)
+        self._compare({'c': [code('1'), code('4')]})
+        self._compare({'c': [code('9')]})
+        self.assertEqual(len(self._compare({'c': ['%s-0.0-100' % var2.id]})), 1)
+        self._compare({'c': ['%s-0.0-100' % var2.id, code('4')]})
+        self._compare({'l': [l.id for l in Language.objects.all()[:2]]})
+        self._compare({'p': [r.id for r in GeographicRegion.objects.all()]})
+        for criterion in [
+            [rainfall.id, 'gt', ['1.5']],
+            [rainfall.id, 'lt', ['1.5']],
+            [rainfall.id, 'inrange', ['0.0', '1.5']],
+            [rainfall.id, 'outrange', ['0.0', '3.0']],
+        ]:
+            self._compare({'e': [criterion]})
+        self._compare({
+            'c': [code('1'), code('4')],
+            'l': [l.id for l in Language.objects.all()],
+            'e': [[rainfall.id, 'lt', ['10']]]})
+
+    def test_rebuild(self):
+        index = search_index.get_index()
+        self.assertIs(search_index.get_index(), index)
+        DataVersion.objects.create()
+        self.assertIsNot(search_index.get_index(), index)
@@ -0,0 +1,32 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+
+from dplace_app.models import *
+from dplace_app.tests.util import DataTestCase
+from dplace_app.stats import variable_stats, HISTOGRAM_BINS
+
+
+class Tests(DataTestCase):
+    def test_variable_stats(self):
+        stats = variable_stats(1, [
+            ('NA', None, 'Missing data'), ('1', 1.0, None), ('3', 3.0, None)])
+        self.assertEqual((stats.count, stats.na_count), (3, 1))
+        self.assertEqual((stats.na_value, stats.na_description), ('NA', 'Missing data'))
+        self.assertEqual((stats.min, stats.max), (1.0, 3.0))
+        self.assertEqual(stats.get_quantiles()[50], 2.0)
+        self.assertEqual(len(stats.get_histogram()), HISTOGRAM_BINS)
+        self.assertEqual(sum(stats.get_histogram()), 2)
+
+        stats = variable_stats(1, [])
+        self.assertIsNone(stats.min)
+        self.assertEqual(stats.get_quantiles(), [])
+
+    def test_build(self):
+        self.assertEqual(
+            VariableStats.objects.count(),
+            Variable.objects.filter(data_type='Continuous').count())
+        stats = Variable.objects.get(label='2').stats
+        self.assertEqual((stats.count, stats.min, stats.max), (2, 56.8, 250.4))
+        stats = Variable.objects.get(name='Temperature').stats
+        self.assertEqual((stats.count, stats.min), (0, None))
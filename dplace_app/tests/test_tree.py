@@ -1,10 +1,17 @@
 # coding: utf8
 from __future__ import unicode_literals
+from time import time
 
 from ete3 import Tree
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-from dplace_app.tree import prune
+from dplace_app.models import LanguageTree, LanguageTreeLabels, LanguageTreeStructure
+from dplace_app.tree import (
+    prune, compact_tree, update_newick, store_compact_tree, build_tree_structures,
+    prune_trees, pruned_newick,
+)
+from dplace_app import tree
+from dplace_app.compact_tree import CompactTree
 
 
 class Tests(TestCase):
@@ -68,3 +75,151 @@ class Tests(TestCase):
         #    \K|
         #       \-J
         self._compare('((((A,B)D,E)F,G)H,(I,J)K)root;', ['A', 'B', 'F', 'H'])
+
+    def test_prune_baseline(self):
+        # Results of the original ete3-based pruning in `update_newick`:
+        small = '((A,B)C,(D,E)F)root;'
+        nested = '((((A,B)D,E)F,G)H,(I,J)K)root;'
+        glotto = \
+            '(((ashk1247:1,abc:1,Ubykh:1)abaz1241:1,' \
+            '(aaaa1234:1,bzyb1238:1,samu1242:1)abkh1244:1)abkh1243:1,' \
+            '((abad1240:1,bezh1247:1,natu1243:1,shap1240:1,xaku1238:1)adyg1241:1,' \
+            '(grea1271:1)kaba1278:1)circ1239:1,ubyk1235:1);'
+        for newick, labels, const_depth, expected in [
+            (small, 'D,E', True, '((D:1,E:1)F:1);'),
+            (small, 'A,B', True, '((A:1,B:1)C:1);'),
+            (small, 'A,D', True, '(A:2,D:2);'),
+            (small, 'A,E', True, '(A:2,E:2);'),
+            (nested, 'A,G', True, '((G:1,A:3)H:1);'),
+            (nested, 'I,J', True, '((I:1,J:1)K:1);'),
+            (nested, 'E,G,J', True, '((G:1,E:2)H:1,J:2);'),
+            (glotto, 'aaaa1234,bzyb1238', True, '((aaaa1234:1,bzyb1238:1)abkh1244:2);'),
+            (glotto, 'abad1240,grea1271', True, '((abad1240:2,grea1271:2)circ1239:1);'),
+            (glotto, 'abc,samu1242,natu1243', True,
+             '((abc:2,samu1242:2)abkh1243:1,natu1243:3);'),
+            (glotto, 'ashk1247,abc', True, '((ashk1247:1,abc:1)abaz1241:2);'),
+            (glotto, 'aaaa1234,abkh1244', True, '(((aaaa1234:1)abkh1244:1)abkh1243:1);'),
+            (small, 'D,E', False, '((D:1,E:1)F:1);'),
+            (small, 'A,B', False, '((A:1,B:1)C:1);'),
+            (small, 'A,D', False, '(A:2,D:2);'),
+            (small, 'A,E', False, '(A:2,E:2);'),
+            (nested, 'A,B', False, '(A:1,B:1);'),
+            (nested, 'A,E', False, '(E:1,A:2);'),
+            (nested, 'A,G', False, '((G:1,A:3)H:1);'),
+            (nested, 'I,J', False, '((I:1,J:1)K:1);'),
+            (nested, 'A,B,G', False, '((G:1,(A:1,B:1)D:2)H:1);'),
+            (nested, 'E,G,J', False, '((G:1,E:2)H:1,J:2);'),
+            (glotto, 'aaaa1234,bzyb1238', False, '(aaaa1234:1,bzyb1238:1);'),
+            (glotto, 'abad1240,grea1271', False, '((abad1240:2,grea1271:2)circ1239:1);'),
+            (glotto, 'abc,samu1242,natu1243', False,
+             '((abc:2,samu1242:2)abkh1243:1,natu1243:3);'),
+            (glotto, 'ashk1247,abc', False, '(ashk1247:1,abc:1);'),
+            (glotto, 'aaaa1234,abkh1244', False, '((aaaa1234:1)abkh1244:2);'),
+        ]:
+            labels = labels.split(',')
+            t = Tree(newick, format=1)
+            prune(t, labels, const_depth=const_depth)
+            self.assertEqual(t.write(format=1), expected)
+            self.assertEqual(
+                CompactTree.from_newick(newick).prune(labels, const_depth=const_depth),
+                expected)
+
+    def test_compact_tree(self):
+        tree._TREES = None
+        t = LanguageTree.objects.create(name='t', newick_string='((A,B)C,(D,E)F)root;')
+        t1 = compact_tree(t, version=1)
+        self.assertEqual(t1.prune(['A', 'B']), '((A:1,B:1)C:1);')
+        self.assertIs(compact_tree(t, version=1), t1)
+        self.assertEqual(len(t1.leaves(0)), 4)
+        compact_tree(t, version=2)
+        self.assertEqual(len(tree._TREES), 2)
+        compact_tree(t)
+        self.assertEqual(len(tree._TREES), 2)
+
+    def test_store_compact_tree(self):
+        t = LanguageTree.objects.create(name='t', newick_string='((A,B)C,(D,E)F)root;')
+        store_compact_tree(t)
+        # The stored structure is used rather than the Newick string:
+        t.newick_string = '(A,B)root;'
+        self.assertEqual(compact_tree(t).prune(['D', 'E']), '((D:1,E:1)F:1);')
+        t.save()
+        self.assertEqual(build_tree_structures(), 1)
+        self.assertIsNone(compact_tree(t).prune(['D', 'E']))
+        LanguageTreeStructure.objects.all().delete()
+        self.assertEqual(compact_tree(t).prune(['A']), '(A:1);')
+
+    def test_update_newick(self):
+        t = LanguageTree.objects.create(
+            name='t.glotto', newick_string='((A,B)C,(D,E)F,(G)H)root;')
+        label = lambda l: LanguageTreeLabels(languageTree=t, label=l)
+        self.assertFalse(update_newick(t, [label('X')]))
+        self.assertTrue(update_newick(t, [label('C')]))
+        self.assertEqual(t.newick_string, '(C:1);')
+        t.newick_string = '((A,B)C,(D,E)F,(G)H)root;'
+        # H is not a leaf and not the ancestor of more than one leaf:
+        self.assertTrue(update_newick(t, [label('H')]))
+        self.assertEqual(t.newick_string, '(H:1);')
+
+    def test_prune_trees(self):
+        trees = [
+            LanguageTree.objects.create(name='t1', newick_string='((A,B)C,(D,E)F)root;'),
+            LanguageTree.objects.create(name='t2', newick_string='(X,Y)root;')]
+        labels = {t.id: {'A', 'D', 'Y'} for t in trees}
+
+        def pruned(**kw):
+            with override_settings(**kw):
+                return [(t.name, t.newick_string, t.partial, t.kept_labels) for t in prune_trees(
+                    [LanguageTree.objects.get(id=t.id) for t in trees], labels)]
+
+        expected = [('t1', '(A:2,D:2);', False, ['A', 'D']), ('t2', '(Y:1);', False, ['Y'])]
+        self.assertEqual(pruned(), expected)
+        self.assertEqual(pruned(DPLACE_TREE_DEADLINE=10), expected)
+        self.assertEqual(
+            pruned(DPLACE_TREE_DEADLINE=0), [('t1', None, True, []), ('t2', None, True, [])])
+
+        store_compact_tree(trees[0])
+        self.assertEqual(pruned(DPLACE_TREE_WORKERS=2), expected)
+        self.assertEqual(pruned(DPLACE_TREE_WORKERS=2, DPLACE_TREE_DEADLINE=10), expected)
+        # Workers may or may not finish before the deadline:
+        for res, exp in zip(pruned(DPLACE_TREE_WORKERS=2, DPLACE_TREE_DEADLINE=0), expected):
+            self.assertIn(res, [exp, (exp[0], None, True, [])])
+
+    def test_prune_trees_cached(self):
+        t = LanguageTree.objects.create(name='t1', newick_string='((A,B)C,(D,E)F)root;')
+        for workers in [0, 2]:
+            tree._PRUNED, tree._TREES = None, None
+            with override_settings(DPLACE_TREE_WORKERS=workers):
+                prune_trees([t], {t.id: {'A', 'D'}}, version=1)
+                tree._TREES = None
+                # Cached results are returned without loading the tree:
+                with self.assertNumQueries(0):
+                    res = prune_trees([t], {t.id: {'A', 'D'}}, version=1)
+            self.assertEqual(res[0].newick_string, '(A:2,D:2);')
+            self.assertIsNone(tree._TREES)
+
+    def test_prune_in_worker(self):
+        ct = CompactTree.from_newick('((A,B)C,(D,E)F)root;')
+        with self.assertNumQueries(0):
+            for data, newick in [(ct.dumps(), None), (None, '((A,B)C,(D,E)F)root;')]:
+                self.assertEqual(
+                    tree._prune_in_worker(('t1', data, newick, {'A', 'D'}, None)),
+                    ('(A:2,D:2);', ['A', 'D']))
+            # Tasks are skipped once the deadline has passed:
+            self.assertIsNone(
+                tree._prune_in_worker(('t1', None, '(A,B)root;', {'A'}, time() - 1)))
+
+    def test_pruned_newick(self):
+        tree._PRUNED = None
+        t = LanguageTree.objects.create(name='t', newick_string='((A,B)C,(D,E)F)root;')
+        label = lambda l: LanguageTreeLabels(languageTree=t, label=l)
+        self.assertEqual(pruned_newick(t, [label('A'), label('D')], version=1), '(A:2,D:2);')
+        self.assertEqual(len(tree._PRUNED), 1)
+        # Cached results are keyed on the set of labels:
+        t.newick_string = '(A,D)root;'
+        tree._TREES = None
+        self.assertEqual(pruned_newick(t, [label('D'), label('A')], version=1), '(A:2,D:2);')
+        self.assertEqual(pruned_newick(t, [label('A'), label('D')], version=2), '(A:1,D:1);')
+        self.assertIsNone(pruned_newick(t, [label('X')], version=2))
+        self.assertEqual(len(tree._PRUNED), 3)
+        self.assertEqual(pruned_newick(t, [label('A'), label('D')]), '(A:1,D:1);')
+        self.assertEqual(len(tree._PRUNED), 3)
@@ -0,0 +1,100 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+from django.db import connection
+
+from dplace_app.models import *
+from dplace_app.tests.util import DataTestCase, DATA
+from dplace_app.load import Repos
+from dplace_app.loader.society import parse_societies
+from dplace_app.loader.variables import load_vars, parse_variables
+from dplace_app.loader.values import load_data, parse_data
+from dplace_app.loader.util import bulk_insert, map_datasets
+
+
+class Tests(DataTestCase):
+    def _values(self):
+        return sorted(
+            (v.society.ext_id, v.variable.label, v.coded_value,
+             tuple(sorted(s.id for s in v.references.all())))
+            for v in Value.objects.all())
+
+    def _check_constraints(self):
+        # Foreign key constraints are only checked at the end of the test transaction,
+        # thus we check them explicitly:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as c:
+                c.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        self.assertFalse(Value.references.through.objects
+                         .exclude(value_id__in=Value.objects.values('id')).exists())
+
+    def test_load_data(self):
+        values = self._values()
+        self.assertTrue(any(refs for _, _, _, refs in values))
+        # References are linked to the inserted values:
+        self._check_constraints()
+
+        Value.objects.all().delete()
+        self.assertEqual(load_data(Repos(DATA), chunk_size=2), len(values))
+        self.assertEqual(self._values(), values)
+        self._check_constraints()
+
+    def test_load_data_workers(self):
+        def values():
+            return [v[1:] for v in Value.objects.order_by('pk').values_list()]
+
+        serial = values()
+        Value.objects.all().delete()
+        self.assertEqual(load_data(Repos(DATA), workers=2), len(serial))
+        self.assertEqual(values(), serial)
+
+    def test_load_vars(self):
+        def variables():
+            return sorted(
+                (v.label, v.name, v.source_id,
+                 tuple(sorted((c.type, c.name) for c in v.index_categories.all())),
+                 tuple(sorted(
+                     (c.code, c.code_number, c.description, c.short_description)
+                     for c in v.codes.all())))
+                for v in Variable.objects.all())
+
+        serial = variables()
+        self.assertTrue(any(codes for _, _, _, _, codes in serial))
+        self.assertTrue(any(
+            code_number is not None
+            for v in serial for _, code_number, _, _ in v[-1]))
+        Value.objects.all().delete()
+        Variable.objects.all().delete()
+        Category.objects.all().delete()
+        self.assertEqual(load_vars(Repos(DATA)), len(serial))
+        self.assertEqual(variables(), serial)
+
+    def test_map_datasets(self):
+        repos = Repos(DATA)
+        for func in [parse_societies, parse_variables, parse_data]:
+            serial = [(ds.id, list(rows)) for ds, rows in map_datasets(func, repos.datasets)]
+            self.assertEqual(
+                [(ds.id, rows) for ds, rows in map_datasets(func, repos.datasets, workers=2)],
+                serial)
+
+    def test_bulk_insert(self):
+        v = Value.objects.first()
+        # COPY is only supported by PostgreSQL:
+        for copy in [True, False] if connection.vendor == 'postgresql' else [False]:
+            values = [
+                Value(
+                    variable=v.variable,
+                    society=v.society,
+                    coded_value='x',
+                    comment='tab\tnew line\n\\N ä %s' % i,
+                    subcase=str(copy))
+                for i in range(3)]
+            self.assertEqual(bulk_insert(Value, values, copy=copy), 3)
+            for value in values:
+                self.assertEqual(Value.objects.get(pk=value.pk).comment, value.comment)
+                self.assertIsNone(Value.objects.get(pk=value.pk).coded_value_float)
+        self.assertEqual(bulk_insert(Value, []), 0)
+        # Rows inserted with explicit ids do not collide with rows created afterwards:
+        self.assertGreater(
+            Value.objects.create(variable=v.variable, society=v.society).pk,
+            values[-1].pk)
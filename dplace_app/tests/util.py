@@ -0,0 +1,19 @@
+# coding: utf8
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from clldutils.path import Path
+
+from dplace_app.load import load
+from dplace_app.loader import sources
+
+DATA = Path(__file__).parent.joinpath('data')
+
+
+class DataTestCase(TestCase):
+    """
+    Test case running with the test data in `DATA` loaded.
+    """
+    def setUp(self):
+        sources._SOURCE_CACHE = {}
+        load(DATA)
@@ -1,9 +1,86 @@
 # coding: utf8
 from __future__ import unicode_literals
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import hashlib
+from multiprocessing import Pool, TimeoutError
+import threading
+from time import time
 
-from ete3 import Tree
-from ete3.coretype.tree import TreeError
+from django.conf import settings
+
+from dplace_app.cache import LRUCache
+from dplace_app.compact_tree import CompactTree
+from dplace_app.models import (
+    LanguageTree, LanguageTreeStructure, LanguageTreeLabelsSequence, SocietyTreeLabel,
+)
+
+# Rough estimate of the memory used per node of a CompactTree - including its LCA index -
+# to enforce the memory budget of the tree cache:
+NODE_BYTES = 400
+_TREES = None
+_PRUNED = None
+_POOL = None
+# Guards the lazy creation of the objects shared by the threads serving requests:
+_LOCK = threading.Lock()
+
+
+def load_compact_tree(t):
+    """
+    :param t: `LanguageTree` instance.
+    :return: `CompactTree` read from the structure stored for the tree, or parsed from \
+    the Newick string if none is stored.
+    """
+    data = LanguageTreeStructure.objects\
+        .filter(languageTree_id=t.id).values_list('data', flat=True).first()
+    if data is not None:
+        return CompactTree.loads(data)
+    return CompactTree.from_newick(t.newick_string)
+
+
+def compact_tree(t, version=None):
+    """
+    Loading large trees is expensive, so we keep the compact representations of the
+    trees in a process-level LRU cache, keyed on tree id and data version.
+
+    :param t: `LanguageTree` instance.
+    :param version: current `DataVersion`; if `None`, the tree is loaded without caching.
+    :return: `CompactTree` instance, which must not be modified.
+    """
+    global _TREES
+    if version is None:
+        return load_compact_tree(t)
+    with _LOCK:
+        # The cache may be created by concurrent requests:
+        if _TREES is None:
+            _TREES = LRUCache(
+                getattr(settings, 'DPLACE_TREE_CACHE_BYTES', 128 * 1024 * 1024))
+    key = (t.id, version)
+    tree = _TREES.get(key)
+    if tree is None:
+        tree = load_compact_tree(t)
+        _TREES.set(key, tree, tree.size * NODE_BYTES)
+    return tree
+
+
+def store_compact_tree(t, tree=None):
+    """
+    Store the serialized `CompactTree` for a tree.
+
+    :param tree: `CompactTree` for `t`, parsed from the Newick string if not passed.
+    """
+    tree = tree or CompactTree.from_newick(t.newick_string)
+    LanguageTreeStructure.objects.update_or_create(
+        languageTree_id=t.id, defaults=dict(data=tree.dumps()))
+    return tree
+
+
+def build_tree_structures():
+    """
+    (Re-)create the stored structures for all trees.
+    """
+    for t in LanguageTree.objects.only('id', 'newick_string'):
+        store_compact_tree(t)
+    return LanguageTreeStructure.objects.count()
 
 
 def prune(tree, nodes, const_depth=True, keep_root=False):
@@ -34,8 +111,10 @@ def prune(tree, nodes, const_depth=True, keep_root=False):
 
     for visitors, nodes_ in visitors2nodes.items():
         if not (to_keep & nodes_):
-            # to choose the closest ancestor for a node we want to keep:
-            to_keep.add(sorted(nodes_, key=lambda n: -n2depth[n])[0])
+            # to choose the closest ancestor for a node we want to keep - breaking ties
+            # in favour of the node farther from the root:
+            to_keep.add(sorted(
+                nodes_, key=lambda n: (-n2depth[n], -len(n.get_ancestors())))[0])
 
     for n in tree.get_descendants('postorder'):
         if n not in to_keep:
@@ -50,25 +129,257 @@ def prune(tree, nodes, const_depth=True, keep_root=False):
                 parent.remove_child(n)
 
 
-def update_newick(t, labels):
+def _pruned_cache():
+    global _PRUNED
+    with _LOCK:
+        # The cache may be created by concurrent requests:
+        if _PRUNED is None:
+            _PRUNED = LRUCache(
+                getattr(settings, 'DPLACE_PRUNED_CACHE_BYTES', 32 * 1024 * 1024))
+    return _PRUNED
+
+
+def _pruned_key(t, langs_in_tree, version):
+    return (
+        t.id,
+        version,
+        hashlib.md5('\n'.join(sorted(langs_in_tree)).encode('utf8')).hexdigest())
+
+
+def _cache_pruned(key, res):
+    _pruned_cache().set(key, res, len(res[0] or '') + sum(len(l) for l in res[1]))
+
+
+def prune_labels(t, langs_in_tree, version=None, tree=None):
+    """
+    Prune the Newick representation of a tree to the labels of the selected societies.
+
+    Popular selections - e.g. all societies of a region - are requested repeatedly, so
+    the results are cached, keyed on tree id, data version and the set of labels.
+
+    :param langs_in_tree: `set` of labels.
+    :param version: current `DataVersion`, passed to look up the tree and the result in \
+    the caches; if `None`, nothing is cached.
+    :param tree: `CompactTree` for `t`; looked up with `compact_tree` if not passed.
+    :return: pair (Newick representation of the pruned tree or `None` if the tree does \
+    not contain any of the labels, sorted `list` of the labels kept in the pruned tree).
+    """
+    if version is None:
+        return _prune_compact(tree or compact_tree(t), t.name, langs_in_tree)
+
+    key = _pruned_key(t, langs_in_tree, version)
+    res = _pruned_cache().get(key)
+    if res is None:
+        res = _prune_compact(
+            tree or compact_tree(t, version=version), t.name, langs_in_tree)
+        _cache_pruned(key, res)
+    return res
+
+
+def _prune_compact(tree, name, langs_in_tree):
+    """
+    :param tree: `CompactTree` of the tree called `name`.
+    :return: see `prune_labels`.
+    """
+    kept = sorted(l for l in langs_in_tree if l in tree.name_index)
+    if not kept:
+        return None, kept
+
+    is_glottolog_tree = '.glotto' in name
+    if is_glottolog_tree and len(kept) == 1:
+        # kind of hacky, but needed for when langs_in_tree is only 1
+        # in future, maybe exclude these trees from the search results?
+        lang = kept[0]
+        leaves = tree.leaves(min(tree.name_index[lang], key=lambda i: tree.depth[i]))
+        if len(leaves) > 1 or (len(leaves) == 1 and tree.names[leaves[0]] == lang):
+            return "(%s:1);" % lang, kept
+
+    return tree.prune(kept, const_depth=is_glottolog_tree), kept
+
+
+def pruned_newick(t, labels, version=None):
+    """
+    :param labels: `LanguageTreeLabels` instances, possibly of other trees, too.
+    :return: Newick representation of the tree pruned to the labels, see `prune_labels`.
+    """
     langs_in_tree = set(str(l.label) for l in labels if l.languageTree_id == t.id)
     if not langs_in_tree:
-        return False
+        return None
+    return prune_labels(t, langs_in_tree, version=version)[0]
+
+
+def update_newick(t, labels, version=None):
+    """
+    Replace the Newick representation of a tree with the one pruned to the labels.
 
-    is_glottolog_tree = '.glotto' in t.name
-    try:
-        newick = Tree(t.newick_string, format=1)
-        if is_glottolog_tree and len(langs_in_tree) == 1:
-            # kind of hacky, but needed for when langs_in_tree is only 1
-            # in future, maybe exclude these trees from the search results?
-            lang = list(langs_in_tree)[0]
-            leaves = newick.search_nodes(name=lang)[0].get_leaves()
-            if len(leaves) > 1 or (len(leaves) == 1 and leaves[0].name == lang):
-                t.newick_string = "(%s:1);" % lang
-                return True
-
-        prune(newick, langs_in_tree, const_depth=is_glottolog_tree)
-        t.newick_string = newick.write(format=1)
-        return True
-    except TreeError:
+    :return: `True` if the tree contains any of the labels.
+    """
+    newick = pruned_newick(t, labels, version=version)
+    if newick is None:
         return False
+    t.newick_string = newick
+    return True
+
+
+def _pool():
+    global _POOL
+    with _LOCK:
+        if _POOL is None:
+            _POOL = Pool(settings.DPLACE_TREE_WORKERS)
+    return _POOL
+
+
+def _prune_in_worker(args):
+    """
+    Prune a tree in a worker process, which gets the serialized tree passed and does not
+    access the database.
+    """
+    name, data, newick, langs_in_tree, deadline = args
+    if deadline is not None and time() >= deadline:
+        # The request has stopped waiting for the result, so we do not keep the pool
+        # busy with it:
+        return None
+    tree = CompactTree.loads(data) if data is not None else CompactTree.from_newick(newick)
+    return _prune_compact(tree, name, langs_in_tree)
+
+
+def _prune_in_pool(trees, labels, version, deadline):
+    """
+    :return: generator of pruning results - or `None` for trees not pruned in time - in \
+    the order of `trees`.
+    """
+    cached, tasks = {}, []
+    for t in trees:
+        if version is not None:
+            cached[t.id] = _pruned_cache().get(_pruned_key(t, labels[t.id], version))
+        if cached.get(t.id) is None:
+            tasks.append(t)
+
+    # The stored structures are read in the request thread - with one query - because
+    # the workers must not access the database:
+    data = dict(LanguageTreeStructure.objects
+                .filter(languageTree_id__in=[t.id for t in tasks])
+                .values_list('languageTree_id', 'data')) if tasks else {}
+    results = {
+        t.id: _pool().apply_async(_prune_in_worker, [(
+            t.name,
+            bytes(data[t.id]) if t.id in data else None,
+            None if t.id in data else t.newick_string,
+            labels[t.id],
+            deadline)])
+        for t in tasks}
+
+    for t in trees:
+        res = cached.get(t.id)
+        if res is None:
+            try:
+                res = results[t.id].get(
+                    timeout=None if deadline is None else max(deadline - time(), 0))
+            except TimeoutError:
+                res = None
+            if res is not None and version is not None:
+                _cache_pruned(_pruned_key(t, labels[t.id], version), res)
+        yield res
+
+
+def _prune_serially(trees, labels, version, deadline):
+    expired = lambda: deadline is not None and time() >= deadline
+    for t in trees:
+        res = None
+        if version is not None:
+            res = _pruned_cache().get(_pruned_key(t, labels[t.id], version))
+        if res is None and not expired():
+            tree = compact_tree(t, version=version)
+            # Loading a tree which is not cached may take a while:
+            if not expired():
+                res = prune_labels(t, labels[t.id], version=version, tree=tree)
+        yield res
+
+
+def prune_trees(trees, labels, version=None):
+    """
+    Prune trees to the labels of the selected societies - in a pool of
+    `DPLACE_TREE_WORKERS` processes, if configured. Trees which are not pruned within
+    `DPLACE_TREE_DEADLINE` seconds are marked as `partial`, with no Newick
+    representation.
+
+    Cached results are looked up in the request thread, before any tree is loaded. The
+    workers get the serialized trees passed, so they do not share the process-level
+    cache of compact trees - but deserializing and pruning large trees runs in parallel.
+    Without workers, the deadline is checked before loading and before pruning each
+    tree.
+
+    :param labels: `dict` mapping tree ids to `set`s of labels.
+    :return: `list` of the trees containing any of the labels, with the labels kept in \
+    the pruned tree as `kept_labels`.
+    """
+    deadline = getattr(settings, 'DPLACE_TREE_DEADLINE', None)
+    if deadline is not None:
+        deadline += time()
+
+    trees = list(trees)
+    prune = _prune_in_pool if getattr(settings, 'DPLACE_TREE_WORKERS', 0) \
+        else _prune_serially
+    res = []
+    for t, result in zip(trees, prune(trees, labels, version, deadline)):
+        if result is None:
+            newick, t.kept_labels, t.partial = None, [], True
+        else:
+            (newick, t.kept_labels), t.partial = result, False
+        if newick is not None or t.partial:
+            t.newick_string = newick
+            res.append(t)
+    return res
+
+
+def build_tree_index():
+    """
+    (Re-)create the mapping of societies to tree labels. Must be run whenever trees have
+    been loaded.
+    """
+    SocietyTreeLabel.objects.all().delete()
+    SocietyTreeLabel.objects.bulk_create([
+        SocietyTreeLabel(
+            society_id=society_id,
+            languageTree_id=tree_id,
+            labels_id=labels_id,
+            label=label,
+            language_id=language_id,
+            fixed_order=fixed_order)
+        for society_id, tree_id, labels_id, label, language_id, fixed_order in
+        LanguageTreeLabelsSequence.objects.values_list(
+            'society_id',
+            'labels__languageTree_id',
+            'labels_id',
+            'labels__label',
+            'labels__language_id',
+            'fixed_order')],
+        batch_size=1000)
+    return SocietyTreeLabel.objects.count()
+
+
+def trees_for_societies(soc_ids, version=None):
+    """
+    Look up the trees containing any of the societies - with one query on the
+    `SocietyTreeLabel` index - and prune them to the labels of these societies.
+
+    :param soc_ids: iterable of society ids.
+    :return: `list` of `LanguageTree` instances, see `prune_trees`, with a `dict` mapping \
+    the kept labels to lists of (society ext_id, fixed_order) pairs as `societies`.
+    """
+    societies = defaultdict(OrderedDict)
+    for tree_id, label, ext_id, fixed_order in SocietyTreeLabel.objects\
+            .filter(society_id__in=soc_ids)\
+            .order_by('languageTree_id', 'label', '-fixed_order', 'society_id')\
+            .values_list('languageTree_id', 'label', 'society__ext_id', 'fixed_order'):
+        societies[tree_id].setdefault(label, []).append([ext_id, fixed_order])
+
+    trees = prune_trees(
+        LanguageTree.objects.filter(id__in=list(societies)).select_related('source')
+        .order_by('id'),
+        {tree_id: set(labels) for tree_id, labels in societies.items()},
+        version=version)
+    for t in trees:
+        t.societies = OrderedDict(
+            (label, societies[t.id][label]) for label in t.kept_labels)
+    return trees
@@ -16,3 +16,4 @@ export DJANGO_SETTINGS_MODULE=dplace.settings
 export PYTHONPATH=$DPLACE_PATH
 
 python "${DPLACE_PATH}/dplace_app/load.py" $1
+python "${DPLACE_PATH}/manage.py" build_society_bitmaps